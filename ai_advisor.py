@@ -2,27 +2,130 @@
 ИИ-советник для анализа новостей (оптимизирован для CPU)
 """
 
+import asyncio
 import logging
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Any, Optional, Union
-from collections import defaultdict
+from collections import OrderedDict, defaultdict
 import json
 import hashlib
+import io
 import os
 import time
 import base64
+import mmap
 import re
+import sqlite3
+import threading
 from news_parser import NewsItem
 # import ollama
-import pandas as pd
+import numpy as np
+import orjson
 import services
 import httpx
-from config import OLLAMA_HOST
+from indicators import sma, crossover_signals
+from config import OLLAMA_HOST, OLLAMA_MODEL, OLLAMA_NUM_THREAD
+
+try:
+    import pybase64 as _b64  # SIMD-реализация base64, если установлена
+except ImportError:
+    _b64 = base64
 
 DISABLE_AI = os.getenv("DISABLE_AI", "false").lower() == "false"
 
 logger = logging.getLogger(__name__)
 
+QUICK_SYSTEM_PROMPT = """Ты агрессивный инвест-советник, склонный к покупкам при малейших позитивных сигналах.
+Если новости нейтральные, но компания фундаментально сильна, рекомендуй BUY.
+
+Ответь ТОЛЬКО JSON:
+{
+    "sentiment": "positive/neutral/negative",
+    "top_pick": "SBER",
+    "action": "BUY/HOLD/SELL",
+    "reason": "кратко (10 слов)",
+    "confidence": 0.8
+}"""
+
+TEXT_SYSTEM_PROMPT = """Проанализируй текст пользователя и определи его влияние на рынок.
+
+Ответь JSON:
+{
+    "sentiment": "positive/negative/neutral",
+    "score": от -1 до 1,
+    "key_points": ["пункт1", "пункт2"],
+    "impact": "high/medium/low"
+}"""
+
+NEWS_WITH_IMAGE_PROMPT = """Ты финансовый аналитик. Проанализируй новость и приложенное к ней изображение.
+
+ЗАГОЛОВОК: {title}
+ТЕКСТ: {text}
+
+В поле image_insight кратко (до 4 предложений) опиши, что изображено и какой вывод можно сделать инвестору.
+Если изображение не относится к новости (логотип, иконка, реклама), напиши там: "Изображение не связано с содержанием поста".
+
+Ответь JSON:
+{{
+    "sentiment": "positive/negative/neutral",
+    "score": от -1 до 1,
+    "key_points": ["пункт1", "пункт2"],
+    "impact": "high/medium/low",
+    "image_insight": "вывод по изображению"
+}}"""
+
+# Динамические части промптов: шаблоны разбираются один раз, в вызовах только .format()
+QUICK_USER_PROMPT = """НОВОСТИ:
+{news}
+
+ЦЕНЫ:
+{prices}
+
+На основе истории новостей:
+{history}"""
+
+IMAGE_NEWS_PROMPT = """Ты финансовый аналитик. Проанализируй изображение и новость.
+
+НОВОСТЬ: {text}
+
+ИЗОБРАЖЕНИЕ приложено.
+
+Опиши кратко:
+1. Тип изображения (график, диаграмма, фото) и что на нём.
+2. Технические сигналы (тренд, уровни, объёмы).
+3. Связь с новостью.
+4. Рекомендация для инвестора.
+
+Ответь в формате JSON:
+{{
+    "image_type": "candle/line/bar/photo/other",
+    "technical_summary": "одно-два предложения",
+    "trend": "up/down/sideways",
+    "key_levels": ["support: X", "resistance: Y"],
+    "relation": "как связано с новостью",
+    "action": "buy/sell/hold",
+    "confidence": 0.8,
+    "detailed_analysis": "развёрнутое объяснение (2-3 предложения)"
+}}"""
+
+IMAGE_POST_PROMPT = """Ты финансовый аналитик. Проанализируй это изображение в контексте поста:
+
+ЗАГОЛОВОК ПОСТА: {title}
+ТЕКСТ ПОСТА: {text}
+
+Если изображение НЕ ОТНОСИТСЯ к теме поста или не несёт полезной информации для инвестора (например, это логотип, иконка, реклама или случайная картинка), просто напиши: "Изображение не связано с содержанием поста".
+
+Если изображение относится к посту, опиши кратко:
+1. Что изображено (график, диаграмма, фото) — какие детали важны для инвестора?
+2. Какой вывод для инвестора можно сделать на основе этого изображения?
+
+Ответь максимум 4 предложениями."""
+
+
+class _NoModelReply(Exception):
+    """Модель не вернула пригодный ответ"""
+
+
 class AIAdvisor:
     """ИИ-советник для инвестиций"""
     
@@ -31,6 +134,22 @@ class AIAdvisor:
     MAX_NEWS_ANALYZE: int = 12
     MAX_NEWS_QUICK: int = 8
     TEMPERATURE: float = 0.3
+    PRICE_CONCURRENCY: int = 16
+    EMBED_MODEL: str = "nomic-embed-text"
+    SEMANTIC_CACHE_THRESHOLD: float = 0.92
+    # Одинаковые num_ctx/num_keep во всех запросах к llm_model: Ollama не перезагружает модель
+    # и держит в KV-кэше общий префикс (системное сообщение)
+    NUM_CTX: int = 4096
+    NUM_KEEP: int = 512
+    OLLAMA_FAILURE_THRESHOLD: int = 3
+    OLLAMA_BACKOFF_BASE: int = 60  # сек, удваивается при повторных срабатываниях
+    OLLAMA_BACKOFF_MAX: int = 600
+    TEXT_CACHE_SIZE: int = 512
+
+    # Ключевые слова для разбора ответа vision-модели
+    _CHART_RE = re.compile(r"график", re.IGNORECASE)
+    _UP_RE = re.compile(r"рост|увелич", re.IGNORECASE)
+    _DOWN_RE = re.compile(r"падени|снижен", re.IGNORECASE)
     
     def __init__(self, tinkoff_token: str) -> None:
         self.vision_model = "moondream:latest"  # "llava:13b" или "bakllava:7b"
@@ -40,11 +159,18 @@ class AIAdvisor:
         self.news_parser = services.news_parser()
         self.db = services.db()
         
-        self.llm_model: str = "gemma3:12b"
+        self.llm_model: str = OLLAMA_MODEL
+        self._base_options: Dict[str, int] = {'num_ctx': self.NUM_CTX, 'num_keep': self.NUM_KEEP}
+        if OLLAMA_NUM_THREAD:
+            self._base_options['num_thread'] = OLLAMA_NUM_THREAD
         self.max_news: int = self.MAX_NEWS_ANALYZE
         self.cache_enabled: bool = True
         self.cache_dir: str = "cache/ai_advisor"
         os.makedirs(self.cache_dir, exist_ok=True)
+        # Оба уровня кэша (точный и семантический) живут в одном SQLite-файле
+        self.cache_db_path: str = f"{self.cache_dir}/cache.db"
+        self._cache_lock = threading.Lock()
+        self._cache_db: sqlite3.Connection = self._open_cache_db()
         
         self.company_info: Dict[str, Dict[str, Any]] = {
             # Нефть и газ (8)
@@ -102,11 +228,93 @@ class AIAdvisor:
             'GLTR': {'name': 'Globaltrans', 'sector': 'Транспорт', 'div_yield': 9.0, 'figi': 'BBG00B3T3HF6'},
         }
 
+        self._tickers: List[str] = list(self.company_info)
+
+        # Статичная часть промптов уходит в системные сообщения — это общий префикс для KV-кэша Ollama
+        companies_table = "\n".join(
+            f"- {info['name']} ({ticker}): див.{info['div_yield']}%"
+            for ticker, info in self.company_info.items()
+        )
+        self._quick_system_msg: Dict[str, str] = {
+            'role': 'system',
+            'content': f"{QUICK_SYSTEM_PROMPT}\n\nКОМПАНИИ (все доступные):\n{companies_table}",
+        }
+        self._text_system_msg: Dict[str, str] = {'role': 'system', 'content': TEXT_SYSTEM_PROMPT}
+        # Ответы модели на тексты новостей: digest -> результат, LRU; пишется из потоков анализа
+        self._text_analysis_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+        self._text_cache_lock = threading.Lock()
+
         logger.info(f"✅ AIAdvisor инициализирован с {len(self.company_info)} компаниями")
         
         self.advice_history: List[Dict[str, Any]] = []
+
+        # Один пул соединений к Ollama на все запросы
+        self._http: httpx.Client = self._create_http_client()
+        # Предохранитель: после серии ошибок не ждём таймаутов, а сразу уходим в fallback
+        self._ollama_failures: int = 0
+        self._ollama_trips: int = 0
+        self._ollama_open_until: float = 0.0
         
         logger.info(f"✅ AIAdvisor с {self.llm_model} инициализирован")
+
+    def _create_http_client(self) -> httpx.Client:
+        return httpx.Client(
+            base_url=OLLAMA_HOST,
+            timeout=httpx.Timeout(30, connect=5),
+            limits=httpx.Limits(max_keepalive_connections=4),
+        )
+
+    def _ollama_unavailable(self) -> bool:
+        """True, пока открыт предохранитель после серии ошибок Ollama"""
+        return time.time() < self._ollama_open_until
+
+    def _record_ollama_result(self, ok: bool) -> None:
+        if ok:
+            self._ollama_failures = 0
+            self._ollama_trips = 0
+            return
+        self._ollama_failures += 1
+        if self._ollama_failures >= self.OLLAMA_FAILURE_THRESHOLD:
+            # Каждое следующее срабатывание подряд удваивает паузу
+            pause = min(self.OLLAMA_BACKOFF_BASE * 2 ** self._ollama_trips, self.OLLAMA_BACKOFF_MAX)
+            self._ollama_open_until = time.time() + pause
+            self._ollama_trips += 1
+            self._ollama_failures = 0
+            logger.warning(f"⚠️ Ollama не отвечает, пропускаю запросы {pause} сек")
+
+    def _post_chat(self, payload: Dict[str, Any], timeout: Optional[float] = None) -> httpx.Response:
+        return self._post_ollama("/api/chat", payload, timeout)
+
+    def _post_ollama(self, path: str, payload: Dict[str, Any], timeout: Optional[float] = None) -> httpx.Response:
+        """POST к Ollama через общий клиент и предохранитель; при протухшем keep-alive повторяет один раз на новом клиенте."""
+        if self._ollama_unavailable():
+            raise _NoModelReply("Ollama временно недоступна")
+
+        kwargs: Dict[str, Any] = {'json': payload}
+        if timeout is not None:
+            kwargs['timeout'] = httpx.Timeout(timeout, connect=5)
+        try:
+            try:
+                response = self._http.post(path, **kwargs)
+            except httpx.RemoteProtocolError:
+                logger.debug("Соединение с Ollama разорвано, пересоздаю клиент")
+                self._http.close()
+                self._http = self._create_http_client()
+                response = self._http.post(path, **kwargs)
+        except httpx.HTTPError:
+            self._record_ollama_result(False)
+            raise
+        if response.is_success:
+            self._record_ollama_result(True)
+        elif response.is_server_error:
+            self._record_ollama_result(False)
+        # 4xx (нет модели, кривой запрос) — ошибка запроса, а не сбой Ollama: счётчики не трогаем
+        return response
+
+    def close(self) -> None:
+        """Закрывает пул соединений к Ollama и базу кэша"""
+        self._http.close()
+        self._cache_db.close()
     
     def _call_ollama_json(self, messages: List[Dict], options: Optional[Dict] = None) -> Optional[Dict]:
         """
@@ -116,16 +324,18 @@ class AIAdvisor:
         if DISABLE_AI:
             logger.info("AI disabled, returning None")
             return None
+        if self._ollama_unavailable():
+            logger.debug("Ollama временно недоступна, пропускаю запрос")
+            return None
 
-        url = f"{OLLAMA_HOST}/api/chat"
         payload = {
             "model": self.llm_model,
             "messages": messages,
-            "options": options or {},
+            "options": {**self._base_options, **(options or {})},
             "stream": False
         }
         try:
-            response = httpx.post(url, json=payload, timeout=30)
+            response = self._post_chat(payload)
             if response.status_code == 200:
                 data = response.json()
                 content = data['message']['content']
@@ -136,38 +346,26 @@ class AIAdvisor:
             logger.error(f"Ошибка вызова Ollama: {e}")
         return None
 
+    @staticmethod
+    def _encode_image(image: Union[str, bytes, io.BytesIO]) -> str:
+        """Кодирует файл в base64 прямо из mmap, без промежуточной копии содержимого.
+        Картинка, уже лежащая в памяти (bytes/BytesIO), кодируется без обращения к диску"""
+        if isinstance(image, io.BytesIO):
+            return _b64.b64encode(image.getbuffer()).decode('ascii')
+        if isinstance(image, (bytes, bytearray)):
+            return _b64.b64encode(image).decode('ascii')
+        with open(image, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return ""
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                return _b64.b64encode(mm).decode('ascii')
+
     def analyze_with_image(self, image_path: str, text: str) -> Optional[str]:
         """Анализирует новость с картинкой"""
         try:
-            with open(image_path, 'rb') as f:
-                image_base64: str = base64.b64encode(f.read()).decode()
+            image_base64: str = self._encode_image(image_path)
             
-            prompt = f"""
-            Ты финансовый аналитик. Проанализируй изображение и новость.
-
-            НОВОСТЬ: {text}
-
-            ИЗОБРАЖЕНИЕ приложено.
-
-            Опиши кратко:
-            1. Тип изображения (график, диаграмма, фото) и что на нём.
-            2. Технические сигналы (тренд, уровни, объёмы).
-            3. Связь с новостью.
-            4. Рекомендация для инвестора.
-
-            Ответь в формате JSON:
-            {{
-                "image_type": "candle/line/bar/photo/other",
-                "technical_summary": "одно-два предложения",
-                "trend": "up/down/sideways",
-                "key_levels": ["support: X", "resistance: Y"],
-                "relation": "как связано с новостью",
-                "action": "buy/sell/hold",
-                "confidence": 0.8,
-                "detailed_analysis": "развёрнутое объяснение (2-3 предложения)"
-            }}
-            """
-            url = f"{OLLAMA_HOST}/api/chat"
+            prompt = IMAGE_NEWS_PROMPT.format(text=text)
             payload = {
                 "model": self.llm_model,
                 "messages": [{
@@ -175,11 +373,11 @@ class AIAdvisor:
                     "content": prompt,
                     "images": [image_base64]
                 }],
-                "options": {"temperature": self.TEMPERATURE},
+                "options": {**self._base_options, "temperature": self.TEMPERATURE},
                 "stream": False
             }
             try:
-                response = httpx.post(url, json=payload, timeout=30)
+                response = self._post_chat(payload)
                 if response.status_code == 200:
                     data = response.json()
                     return data['message']['content']
@@ -194,78 +392,112 @@ class AIAdvisor:
 
     def _analyze_news_with_images(self, news_list: List[NewsItem]) -> List[Dict]:
         """Анализирует новости с изображениями, возвращает структурированный результат."""
-        results = []
-        for news in news_list[:3]:  # анализируем топ‑3 новости
-            # Текстовый анализ
-            text_analysis = self._analyze_text(news.title + " " + news.summary)
-            
-            # Анализ картинки, если есть
-            image_analysis = None
-            if news.image_path and os.path.exists(news.image_path):
-                try:
-                    image_analysis = self.analyze_image(news.image_path, news.title)
-                except Exception as e:
-                    logger.error(f"Ошибка при анализе картинки {news.image_path}: {e}")
-            
-            # Объединяем результаты
-            combined = self._combine_analysis(text_analysis, image_analysis)
-            
-            results.append({
-                'title': news.title,
-                'source': news.source,
-                'text_analysis': text_analysis,
-                'image_analysis': image_analysis,
-                'combined': combined,
-                'has_image': image_analysis is not None
-            })
+        top_news = news_list[:3]  # анализируем топ‑3 новости
+
+        # Все вызовы модели независимы и упираются в I/O — запускаем их одновременно
+        with ThreadPoolExecutor(max_workers=len(top_news) or 1) as executor:
+            futures = []
+            for news in top_news:
+                text = news.title + " " + news.summary
+                if self.vision_enabled and news.image_path and os.path.exists(news.image_path):
+                    # Текст и картинка разбираются одним мультимодальным запросом
+                    future = executor.submit(self._analyze_text_and_image, text, news.image_path, news.title)
+                else:
+                    future = executor.submit(lambda t: (self._analyze_text(t), None), text)
+                futures.append((news, future))
+
+            results = []
+            for news, future in futures:
+                text_analysis, image_analysis = future.result()
+
+                # Объединяем результаты
+                combined = self._combine_analysis(text_analysis, image_analysis)
+
+                results.append({
+                    'title': news.title,
+                    'title_60': news.title_60,
+                    'source': news.source,
+                    'text_analysis': text_analysis,
+                    'image_analysis': image_analysis,
+                    'combined': combined,
+                    'has_image': image_analysis is not None
+                })
         return results
 
-    def _analyze_text(self, text: str) -> Dict[str, Any]:
-        prompt = f"""
-        Проанализируй этот текст и определи его влияние на рынок:
-        
-        {text[:500]}
-        
-        Ответь JSON:
-        {{
-            "sentiment": "positive/negative/neutral",
-            "score": от -1 до 1,
-            "key_points": ["пункт1", "пункт2"],
-            "impact": "high/medium/low"
-        }}
+    def _analyze_text_and_image(self, text: str, image_path: str, title: str) -> tuple:
         """
-        messages = [{'role': 'user', 'content': prompt}]
+        Один запрос к vision-модели вместо двух: возвращает (анализ текста, вывод по картинке).
+        Если запрос не удался, откатывается на текстовый анализ без картинки.
+        """
+        try:
+            payload = {
+                "model": self.vision_model,
+                "messages": [{
+                    "role": "user",
+                    "content": NEWS_WITH_IMAGE_PROMPT.format(title=title, text=text[:500]),
+                    "images": [self._encode_image(image_path)]
+                }],
+                "options": {"temperature": self.TEMPERATURE},
+                "stream": False
+            }
+            response = self._post_chat(payload, timeout=60)
+            if response.status_code == 200:
+                result = self._extract_json(response.json()['message']['content'])
+                if result:
+                    text_analysis = {
+                        'sentiment': result.get('sentiment', 'neutral'),
+                        'score': result.get('score', 0),
+                        'key_points': list(result.get('key_points', [])),
+                        'impact': result.get('impact', 'low'),
+                    }
+                    return text_analysis, result.get('image_insight') or None
+            else:
+                logger.error(f"Ошибка при анализе картинки: {response.status_code} - {response.text}")
+        except Exception as e:
+            logger.error(f"Ошибка при анализе картинки {image_path}: {e}")
+        return self._analyze_text(text), None
+
+    def _analyze_text(self, text: str) -> Dict[str, Any]:
+        snippet = text[:500]
+        text_hash = hashlib.blake2b(snippet.encode(), digest_size=16).digest()
+        try:
+            result = self._analyze_text_cached(text_hash, snippet)
+        except _NoModelReply:
+            return {'sentiment': 'neutral', 'score': 0, 'key_points': [], 'impact': 'low'}
+        # Копия: _combine_analysis дописывает key_points, а закэшированный ответ должен остаться нетронутым
+        return {**result, 'key_points': list(result.get('key_points', []))}
+
+    def _analyze_text_cached(self, text_hash: bytes, text: str) -> Dict[str, Any]:
+        """Вызов модели для _analyze_text с кэшем по text_hash; неудачи бросают _NoModelReply и не кэшируются."""
+        with self._text_cache_lock:
+            if text_hash in self._text_analysis_cache:
+                self._text_analysis_cache.move_to_end(text_hash)
+                return self._text_analysis_cache[text_hash]
+
+        messages = [self._text_system_msg, {'role': 'user', 'content': text}]
         options = {'temperature': self.TEMPERATURE}
         result = self._call_ollama_json(messages, options)
-        if result:
-            return result
-        return {'sentiment': 'neutral', 'score': 0, 'key_points': [], 'impact': 'low'}
+        if not result:
+            raise _NoModelReply
+
+        with self._text_cache_lock:
+            self._text_analysis_cache[text_hash] = result
+            self._text_analysis_cache.move_to_end(text_hash)
+            while len(self._text_analysis_cache) > self.TEXT_CACHE_SIZE:
+                self._text_analysis_cache.popitem(last=False)
+        return result
 
-    def analyze_image(self, image_path: str, news_text: str) -> Optional[str]:
-        """Анализирует изображение с использованием мультимодальной модели."""
+    def analyze_image(self, image: Union[str, bytes, io.BytesIO], news_text: str) -> Optional[str]:
+        """Анализирует изображение (путь к файлу или PNG/JPEG в памяти) мультимодальной моделью."""
         if not self.vision_enabled:
             return None
 
         try:
-            with open(image_path, 'rb') as f:
-                image_base64 = base64.b64encode(f.read()).decode()
-
-            prompt = f"""
-    Ты финансовый аналитик. Проанализируй это изображение в контексте поста:
-
-    ЗАГОЛОВОК ПОСТА: {news_text.split(chr(10))[0] if chr(10) in news_text else news_text}
-    ТЕКСТ ПОСТА: {news_text}
-
-    Если изображение НЕ ОТНОСИТСЯ к теме поста или не несёт полезной информации для инвестора (например, это логотип, иконка, реклама или случайная картинка), просто напиши: "Изображение не связано с содержанием поста".
-
-    Если изображение относится к посту, опиши кратко:
-    1. Что изображено (график, диаграмма, фото) — какие детали важны для инвестора?
-    2. Какой вывод для инвестора можно сделать на основе этого изображения?
+            image_base64 = self._encode_image(image)
 
-    Ответь максимум 4 предложениями.
-    """
+            title = news_text.split(chr(10))[0] if chr(10) in news_text else news_text
+            prompt = IMAGE_POST_PROMPT.format(title=title, text=news_text)
 
-            url = f"{OLLAMA_HOST}/api/chat"
             payload = {
                 "model": self.vision_model,
                 "messages": [{
@@ -277,7 +509,7 @@ class AIAdvisor:
                 "stream": False
             }
 
-            response = httpx.post(url, json=payload, timeout=60)  # Увеличим timeout для картинок
+            response = self._post_chat(payload, timeout=60)  # Увеличим timeout для картинок
             if response.status_code == 200:
                 data = response.json()
                 content = data['message']['content']
@@ -305,11 +537,11 @@ class AIAdvisor:
 
         if image_analysis:
             # Пытаемся определить, является ли изображение графиком
-            if 'график' in image_analysis.lower():
-                if any(word in image_analysis.lower() for word in ['рост', 'увелич']):
+            if self._CHART_RE.search(image_analysis):
+                if self._UP_RE.search(image_analysis):
                     result['combined_score'] = min(1.0, result['combined_score'] + 0.2)
                     result['key_points'].append('📈 Технический сигнал: график показывает рост')
-                elif any(word in image_analysis.lower() for word in ['падени', 'снижен']):
+                elif self._DOWN_RE.search(image_analysis):
                     result['combined_score'] = max(-1.0, result['combined_score'] - 0.2)
                     result['key_points'].append('📉 Технический сигнал: график показывает падение')
                 else:
@@ -329,7 +561,12 @@ class AIAdvisor:
             start: int = text.find('{')
             end: int = text.rfind('}') + 1
             if start != -1 and end > start:
-                return json.loads(text[start:end])
+                fragment: str = text[start:end]
+                try:
+                    return orjson.loads(fragment)
+                except orjson.JSONDecodeError:
+                    # orjson строже stdlib (например, к NaN) — даём stdlib второй шанс
+                    return json.loads(fragment)
         except:
             pass
         return {}
@@ -346,8 +583,9 @@ class AIAdvisor:
         logger.info(f"💰 Получены цены для {len(prices)} компаний")
 
         # 2. Проверяем свежий кэш
+        embedding = None
         if self.cache_enabled:
-            cached = self._check_cache(news)
+            cached, embedding = self._check_cache(news)
             if cached:
                 logger.info(f"✅ Использован свежий кэш (время: {time.time()-start_time:.1f} сек)")
                 return cached
@@ -373,7 +611,7 @@ class AIAdvisor:
 
         # 5. Если анализ успешен, сохраняем в кэш и историю
         if self.cache_enabled:
-            self._save_cache(news, analysis)
+            self._save_cache(news, analysis, embedding)
 
         total_time = time.time() - start_time
         logger.info(f"✅ Анализ завершён за {total_time:.1f} сек")
@@ -383,13 +621,13 @@ class AIAdvisor:
 
     def _quick_analysis(self, news: List[NewsItem], prices: Dict[str, float]) -> Dict[str, Any]:
         # Формируем сводку по новостям (как было, ограничиваем MAX_NEWS_QUICK)
-        news_summary = "\n".join([f"- [{n.source}] {n.title[:100]}" for n in news[:self.MAX_NEWS_QUICK]])
+        news_summary = "\n".join([f"- [{n.source}] {n.title_100}" for n in news[:self.MAX_NEWS_QUICK]])
 
         # --- ИЗМЕНЕНИЕ: теперь берем ВСЕ тикеры, для которых есть цена ---
-        tickers_with_price = [ticker for ticker in self.company_info if ticker in prices]
-        companies_summary = "\n".join([
-            f"- {self.company_info[ticker]['name']} ({ticker}): {prices[ticker]:.0f}₽, див.{self.company_info[ticker]['div_yield']}%"
-            for ticker in tickers_with_price
+        # (названия и дивиденды уже в системном сообщении, здесь только цены)
+        prices_summary = "\n".join([
+            f"- {ticker}: {prices[ticker]:.0f}₽"
+            for ticker in self._tickers if ticker in prices
         ])
 
         # Получаем историю анализов для компаний (топ-5 по ценам, как было)
@@ -402,29 +640,9 @@ class AIAdvisor:
                 for p in past:
                     history_context += f"- {p.get('summary', '')} (сентимент {p.get('sentiment')})\n"
 
-        prompt = f"""Ты агрессивный инвест-советник, склонный к покупкам при малейших позитивных сигналах. 
-        Если новости нейтральные, но компания фундаментально сильна, рекомендуй BUY.
-
-        НОВОСТИ:
-        {news_summary}
-
-        КОМПАНИИ (все доступные):
-        {companies_summary}
-
-        Ответь ТОЛЬКО JSON:
-        {{
-            "sentiment": "positive/neutral/negative",
-            "top_pick": "SBER",
-            "action": "BUY/HOLD/SELL",
-            "reason": "кратко (10 слов)",
-            "confidence": 0.8
-        }}
+        prompt = QUICK_USER_PROMPT.format(news=news_summary, prices=prices_summary, history=history_context)
 
-        На основе истории новостей: 
-        {history_context}
-        """
-
-        messages = [{'role': 'user', 'content': prompt}]
+        messages = [self._quick_system_msg, {'role': 'user', 'content': prompt}]
         options = {'temperature': self.TEMPERATURE, 'num_predict': 200}
         result = self._call_ollama_json(messages, options)
 
@@ -433,7 +651,7 @@ class AIAdvisor:
             return self._get_fallback_analysis(news, prices)
 
         return {
-            'timestamp': datetime.now(),
+            'timestamp': int(time.time()),
             'news_count': len(news),
             'companies_analyzed': len(prices),  # теперь это количество компаний с ценами
             'market_sentiment': result.get('sentiment', 'neutral'),
@@ -444,35 +662,149 @@ class AIAdvisor:
             'prices': prices,
         }
 
-    def _check_cache(self, news: List[NewsItem]) -> Optional[Dict[str, Any]]:
-        """Проверяет кэш"""
+    def _check_cache(self, news: List[NewsItem]) -> tuple:
+        """
+        Проверяет кэш: сначала точное совпадение заголовков, затем похожие по смыслу.
+        Возвращает (анализ или None, эмбеддинг заголовков или None) — эмбеддинг считается
+        один раз на промах и потом сохраняется вместе с новым анализом.
+        """
         if not news:
-            return None
+            return None, None
         
-        titles: str = "".join([n.title for n in news[:5]])
-        cache_key: str = hashlib.md5(titles.encode()).hexdigest()
-        cache_file: str = f"{self.cache_dir}/{cache_key}.json"
+        cache_key: str = self._news_key(news)
         
-        if os.path.exists(cache_file):
-            file_age: float = time.time() - os.path.getmtime(cache_file)
-            if file_age < self.CACHE_TTL:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    data: Dict[str, Any] = json.load(f)
-                    data['from_cache'] = True
-                    data['cache_age'] = f"{file_age/60:.0f} мин"
-                    return data
+        cached = self._load_cached(cache_key)
+        if cached:
+            return cached, None
+
+        # Семантический уровень: те же новости в другой формулировке
+        embedding = self._embed(self._news_titles(news))
+        if embedding is None:
+            return None, None
+
+        match = self._semantic_lookup(embedding)
+        if match:
+            similar_key, similarity = match
+            cached = self._load_cached(similar_key)
+            if cached:
+                logger.info(f"🧠 Семантический кэш: сходство {similarity:.2f}")
+                return cached, embedding
         
+        return None, embedding
+
+    @staticmethod
+    def _news_key(news: List[NewsItem]) -> str:
+        """Ключ кэша по первым пяти заголовкам; хэш обновляется по частям, без склейки строк"""
+        h = hashlib.blake2b(digest_size=16)
+        for n in news[:5]:
+            h.update(n.title.encode('utf-8', 'ignore'))
+        return h.hexdigest()
+
+    @staticmethod
+    def _news_titles(news: List[NewsItem]) -> str:
+        return "".join([n.title for n in news[:5]])
+
+    def _load_cached(self, cache_key: str) -> Optional[Dict[str, Any]]:
+        """Читает анализ из кэша, если он ещё не устарел"""
+        try:
+            with self._cache_lock:
+                row = self._cache_db.execute(
+                    "SELECT payload, mtime FROM cache WHERE cache_key = ?", (cache_key,)
+                ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения кэша: {e}")
+            return None
+        if row:
+            payload, mtime = row
+            age: float = time.time() - mtime
+            if age < self.CACHE_TTL:
+                data: Dict[str, Any] = orjson.loads(payload)
+                data['from_cache'] = True
+                data['cache_age'] = f"{age/60:.0f} мин"
+                return data
+        return None
+
+    def _open_cache_db(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.cache_db_path, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache (
+                cache_key TEXT PRIMARY KEY,
+                mtime INTEGER NOT NULL,
+                payload BLOB NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS semantic_cache (
+                cache_key TEXT PRIMARY KEY,
+                embedding BLOB NOT NULL,
+                created_at REAL NOT NULL
+            )
+        ''')
+        return conn
+
+    def _embed(self, text: str) -> Optional[np.ndarray]:
+        """Возвращает нормированный эмбеддинг текста через Ollama или None"""
+        if DISABLE_AI:
+            return None
+        try:
+            response = self._post_ollama("/api/embeddings", {"model": self.EMBED_MODEL, "prompt": text})
+            if response.status_code == 200:
+                vector = np.asarray(response.json().get('embedding', []), dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                if norm > 0:
+                    return vector / norm
+            else:
+                logger.debug(f"Ollama embeddings вернул {response.status_code}")
+        except Exception as e:
+            logger.debug(f"Ошибка получения эмбеддинга: {e}")
+        return None
+
+    def _semantic_lookup(self, embedding: np.ndarray) -> Optional[tuple]:
+        """Ищет самый похожий свежий анализ; возвращает (cache_key, сходство) или None"""
+        try:
+            with self._cache_lock:
+                rows = self._cache_db.execute(
+                    "SELECT cache_key, embedding FROM semantic_cache WHERE created_at > ?",
+                    (time.time() - self.CACHE_TTL,)
+                ).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка чтения семантического кэша: {e}")
+            return None
+
+        best_key, best_sim = None, -1.0
+        for key, blob in rows:
+            vector = np.frombuffer(blob, dtype=np.float32)
+            if vector.shape != embedding.shape:
+                continue
+            sim = float(vector @ embedding)
+            if sim > best_sim:
+                best_key, best_sim = key, sim
+
+        if best_key is not None and best_sim > self.SEMANTIC_CACHE_THRESHOLD:
+            return best_key, best_sim
         return None
+
+    def _save_semantic_entry(self, cache_key: str, embedding: np.ndarray) -> None:
+        """Запоминает эмбеддинг заголовков для будущих семантических попаданий"""
+        try:
+            with self._cache_lock:
+                self._cache_db.execute(
+                    "INSERT OR REPLACE INTO semantic_cache (cache_key, embedding, created_at) VALUES (?, ?, ?)",
+                    (cache_key, embedding.astype(np.float32).tobytes(), time.time())
+                )
+                self._cache_db.execute("DELETE FROM semantic_cache WHERE created_at < ?", (time.time() - self.CACHE_TTL,))
+        except sqlite3.Error as e:
+            logger.error(f"Ошибка записи семантического кэша: {e}")
     
-    def _save_cache(self, news: List[NewsItem], analysis: Dict[str, Any]) -> None:
-        """Сохраняет анализ в кэш"""
+    def _save_cache(self, news: List[NewsItem], analysis: Dict[str, Any],
+                    embedding: Optional[np.ndarray] = None) -> None:
+        """Сохраняет анализ в кэш; embedding — посчитанный при проверке кэша, если он есть"""
         try:
-            titles: str = "".join([n.title for n in news[:5]])
-            cache_key: str = hashlib.md5(titles.encode()).hexdigest()
-            cache_file: str = f"{self.cache_dir}/{cache_key}.json"
+            cache_key: str = self._news_key(news)
             
             cache_data: Dict[str, Any] = {
-                'timestamp': analysis['timestamp'].isoformat(),
+                'timestamp': analysis['timestamp'],
                 'news_count': analysis['news_count'],
                 'companies_analyzed': analysis['companies_analyzed'],
                 'market_sentiment': analysis['market_sentiment'],
@@ -483,8 +815,16 @@ class AIAdvisor:
                 'prices': analysis['prices'],
             }
             
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump(cache_data, f, indent=2, ensure_ascii=False)
+            now = int(time.time())
+            with self._cache_lock:
+                self._cache_db.execute(
+                    "INSERT OR REPLACE INTO cache (cache_key, mtime, payload) VALUES (?, ?, ?)",
+                    (cache_key, now, orjson.dumps(cache_data))
+                )
+                self._cache_db.execute("DELETE FROM cache WHERE mtime < ?", (now - self.CACHE_TTL,))
+
+            if embedding is not None:
+                self._save_semantic_entry(cache_key, embedding)
                 
         except Exception as e:
             logger.error(f"Ошибка сохранения кэша: {e}")
@@ -520,21 +860,35 @@ class AIAdvisor:
     #     return prices
 
     def _get_current_prices(self) -> Dict[str, float]:
-        """Получает цены только для интересующих нас тикеров (из company_info)."""
-        prices = {}
-        for ticker in self.company_info.keys():
-            try:
-                price_info = self.stock_provider.get_price(ticker)
-                if price_info and price_info.get('last_price'):
-                    prices[ticker] = price_info['last_price']
-            except Exception:
-                continue
-        return prices
+        """
+        Получает цены только для интересующих нас тикеров (из company_info).
+        Синхронный путь для рабочих потоков: analyze_all из цикла событий вызывается через asyncio.to_thread.
+        """
+        return asyncio.run(self._get_current_prices_async())
+
+    async def _get_current_prices_async(self) -> Dict[str, float]:
+        """Запрашивает цены всех тикеров параллельно через один пул соединений."""
+        sem = asyncio.Semaphore(self.PRICE_CONCURRENCY)
+        limits = httpx.Limits(max_keepalive_connections=32, max_connections=32)
+
+        async with httpx.AsyncClient(limits=limits, timeout=5.0) as client:
+            async def fetch(ticker: str) -> Optional[float]:
+                async with sem:
+                    try:
+                        price_info = await self.stock_provider.get_price_async(ticker, client)
+                    except Exception:
+                        return None
+                return price_info.get('last_price') if price_info else None
+
+            tickers = self._tickers
+            results = await asyncio.gather(*[fetch(t) for t in tickers])
+
+        return {ticker: price for ticker, price in zip(tickers, results) if price}
 
     def _get_fallback_analysis(self, news: List[NewsItem], prices: Dict[str, float]) -> Dict[str, Any]:
         """Запасной вариант если ИИ не отвечает"""
         return {
-            'timestamp': datetime.now(),
+            'timestamp': int(time.time()),
             'news_count': len(news),
             'companies_analyzed': len(prices),
             'market_sentiment': 'neutral',
@@ -571,7 +925,7 @@ class AIAdvisor:
             lines.append("")
             lines.append("*📸 Детальный анализ новостей с изображениями:*")
             for item in analysis['detailed_news'][:2]:  # показываем первые две
-                lines.append(f"  • {item['title'][:60]}...")
+                lines.append(f"  • {item.get('title_60') or item['title'][:60]}...")
                 if item.get('image_insight'):
                     # Обрезаем длинный ответ для компактности
                     # insight = item['image_insight'][:1000] + ('...' if len(item['image_insight']) > 100 else '')
@@ -588,22 +942,16 @@ class AIAdvisor:
 
         return "\n".join(lines)
 
-    def generate_signals_ma(self, prices: List[Dict], short_window=5, long_window=20) -> List[int]:
+    def generate_signals_ma(self, prices: Union[List[Dict], np.ndarray], short_window=5, long_window=20) -> List[int]:
         """
         Простая стратегия: когда короткая средняя пересекает длинную сверху — продаём,
-        снизу — покупаем.
+        снизу — покупаем. prices — свечи из get_history или готовый массив цен закрытия.
         """
-        df = pd.DataFrame(prices)
-        df['ma_short'] = df['close'].rolling(window=short_window).mean()
-        df['ma_long'] = df['close'].rolling(window=long_window).mean()
-        
-        signals = [0] * len(df)
-        for i in range(1, len(df)):
-            if df['ma_short'].iloc[i] > df['ma_long'].iloc[i] and df['ma_short'].iloc[i-1] <= df['ma_long'].iloc[i-1]:
-                signals[i] = 1  # buy
-            elif df['ma_short'].iloc[i] < df['ma_long'].iloc[i] and df['ma_short'].iloc[i-1] >= df['ma_long'].iloc[i-1]:
-                signals[i] = -1  # sell
-        return signals
+        if isinstance(prices, np.ndarray):
+            close = prices.astype(np.float64, copy=False)
+        else:
+            close = np.fromiter((p['close'] for p in prices), dtype=np.float64, count=len(prices))
+        return crossover_signals(sma(close, short_window), sma(close, long_window)).tolist()
 
 def test_ai_advisor() -> None:
     """Тестирование"""
@@ -5,19 +5,142 @@
 
 import asyncio
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime
 from typing import Dict, List, Any, Optional
+from collections import OrderedDict
+import hashlib
 import json
 import os
+import re
+import time
+import numpy as np
+import orjson
+from telegram.error import RetryAfter
 from config import TINKOFF_TOKEN
+from jit_utils import njit, NUMBA_AVAILABLE
 import services
 # import ollama
 
 logger = logging.getLogger(__name__)
 
+# Ключевые слова для важных новостей
+IMPORTANT_KEYWORDS = {
+    'кризис': 1.0, 'обвал': 1.0, 'рекорд': 0.8, 'санкции': 1.0,
+    'дефолт': 1.0, 'слияние': 0.7, 'поглощение': 0.7, 'дивиденды': 0.6,
+    'отчетность': 0.5, 'иск': 0.6, 'штраф': 0.6, 'расследование': 0.6,
+    'назначение': 0.4, 'отставка': 0.5, 'теракт': 1.0, 'война': 1.0,
+    'катастрофа': 1.0, 'эмбарго': 0.9, 'забастовка': 0.6,
+    'банкротство': 0.9, 'национализация': 0.9, 'рекордный': 0.7
+}
+POSITIVE_WORDS = ('рост', 'прибыль', 'успех', 'рекорд', 'повышение',
+                  'увеличение', 'выигрыш', 'доход', 'дивиденды')
+NEGATIVE_WORDS = ('падение', 'убыток', 'кризис', 'санкции', 'снижение',
+                  'обвал', 'потеря', 'долг', 'проблема')
+
+
+def _count_present(texts: np.ndarray, words) -> np.ndarray:
+    """Сколько слов из words встречается в каждом тексте (каждое слово — не больше одного раза)"""
+    # Ключевые слова — основы ('рост' должен находить 'роста', 'ростом'), поэтому ищем подстроки;
+    # np.char.find проходит по всем текстам сразу, на Python остаётся только цикл по словам
+    counts = np.zeros(len(texts), dtype=np.int64)
+    for word in words:
+        counts += np.char.find(texts, word) >= 0
+    return counts
+
+
+@njit(cache=True)
+def _sentiment_score_kernel(pos, neg, weights):
+    """Средний взвешенный сентимент по новостям, где нашлось хоть одно слово; NaN, если таких нет"""
+    total = 0.0
+    analyzed = 0
+    for i in range(pos.shape[0]):
+        hits = pos[i] + neg[i]
+        if hits > 0:
+            total += ((pos[i] - neg[i]) / hits) * weights[i]
+            analyzed += 1
+    if analyzed == 0:
+        return np.nan
+    return total / analyzed
+
+
+def _sentiment_score_vectorized(pos: np.ndarray, neg: np.ndarray, weights: np.ndarray) -> float:
+    """То же, что _sentiment_score_kernel, на масках NumPy — без numba это быстрее цикла"""
+    hits = pos + neg
+    analyzed = hits > 0
+    if not analyzed.any():
+        return np.nan
+    return float(((pos[analyzed] - neg[analyzed]) / hits[analyzed] * weights[analyzed]).mean())
+
+
+_sentiment_score = _sentiment_score_kernel if NUMBA_AVAILABLE else _sentiment_score_vectorized
+
+
+# Шаблоны сообщений мониторинга: постоянная часть задана один раз, подставляются только значения
+STARTUP_TEMPLATE = (
+    "🤖 *АВТОМАТИЧЕСКИЙ ИИ-МОНИТОРИНГ ЗАПУЩЕН*\n\n"
+    "Я буду следить за рынком 24/7 и присылать:\n"
+    "• 🚨 *Важные новости* (кризисы, рекорды, санкции)\n"
+    "• 📊 *Изменения настроений* рынка\n"
+    "• 💡 *Инвестиционные идеи* от ИИ\n"
+    "• ⚠️ *Предупреждения* о рисках\n\n"
+    "🕒 Проверка каждые {hours:.0f} час(а)\n"
+    "🔍 Анализ при появлении важных событий\n\n"
+    "Используй /monitor для управления"
+)
+IMPORTANT_NEWS_TEMPLATE = (
+    "{emoji} *СРОЧНАЯ НОВОСТЬ*\n\n"
+    "📰 *{title}*\n"
+    "📍 Источник: {source}\n"
+    "🕒 {published}\n"
+    "🔗 [Читать]({link})"
+)
+SENTIMENT_TEMPLATE = (
+    "{emoji} *ИЗМЕНЕНИЕ РЫНОЧНЫХ НАСТРОЕНИЙ*\n\n"
+    "Тренд: {trend}\n"
+    "Текущий сентимент: {sentiment:.2f}\n"
+    "Изменение: {change:+.2f}\n\n"
+    "💡 Используй /advice для детального анализа"
+)
+ACTIVITY_UP_TEMPLATE = (
+    "📊 *ПОВЫШЕННАЯ АКТИВНОСТЬ*\n\n"
+    "За последний час появилось {diff} новых новостей\n"
+    "Всего в ленте: {count}\n\n"
+    "Рекомендую проверить /news"
+)
+ACTIVITY_DOWN_TEMPLATE = (
+    "📊 *СНИЖЕНИЕ АКТИВНОСТИ*\n\n"
+    "Новостей стало на {diff} меньше\n"
+    "Всего в ленте: {count}"
+)
+MARKET_ANALYSIS_HEADER = "🤖 *АВТОМАТИЧЕСКИЙ АНАЛИЗ РЫНКА*\n\n"
+
+
+def _format_published(t: datetime) -> str:
+    """Время публикации в виде 'ЧЧ:ММ ДД.ММ.ГГГГ' без strftime (он обращается к локали)"""
+    return f"{t.hour:02d}:{t.minute:02d} {t.day:02d}.{t.month:02d}.{t.year}"
+
+
 class AIMarketMonitor:
     """Автоматический мониторинг рынка с ИИ"""
     
+    MAX_NOTIFIED_EVENTS = 10000
+    MAX_SEEN_NEWS = 5000
+    FULL_ANALYSIS_INTERVAL = 6 * 3600  # Полный анализ не реже раза в 6 часов
+    STATE_FILE = 'data/monitor_state.json'
+    SEND_CONCURRENCY = 3
+    
+    # Ключевые слова важных новостей, от самых весомых к менее весомым: первое найденное и есть максимум
+    _IMPORTANT_KEYWORDS = IMPORTANT_KEYWORDS
+    _IMPORTANT_BY_WEIGHT = tuple(sorted(IMPORTANT_KEYWORDS.items(), key=lambda kv: -kv[1]))
+    # Та же очерёдность в альтернативе: в каждой позиции захватывается самое весомое слово из начинающихся там,
+    # поэтому максимум по захваченным словам равен максимуму по всем вхождениям (без сканирования слов сентимента)
+    _IMPORTANT_RE = re.compile('(?=(' + '|'.join(re.escape(kw) for kw, _ in _IMPORTANT_BY_WEIGHT) + '))')
+    
+    # Источники с повышенным весом при подсчёте сентимента
+    _HIGH_WEIGHT_SOURCES = frozenset({'interfax', 'tass', 'bloomberg', 'reuters'})
+    _POSITIVE_WORDS = POSITIVE_WORDS
+    _NEGATIVE_WORDS = NEGATIVE_WORDS
+    
     def __init__(self, bot, chat_id: Optional[int] = None):
         self.bot = bot
         self.chat_id: Optional[int] = chat_id
@@ -29,9 +152,15 @@ class AIMarketMonitor:
         self.check_interval = 3600  # Проверка каждый час
         self.last_check = datetime.now()
         self.last_news_count = 0
-        self.notified_events = set()  # Чтобы не повторяться
+        self.notified_events: "OrderedDict[str, None]" = OrderedDict()  # Чтобы не повторяться (LRU)
         self.last_sentiment = 0
-        self.last_analysis_time = datetime.now() - timedelta(hours=6)
+        # Время последнего полного анализа по time.monotonic(): переводы системных часов не сбивают интервал
+        self.last_analysis_at = time.monotonic() - self.FULL_ANALYSIS_INTERVAL
+        self._wake = asyncio.Event()
+        self._last_important_count = 0  # Сколько важных новостей нашли за последнюю проверку
+        # Счётчики (pos, neg) уже разобранных новостей по ссылке: ленты повторяются от проверки к проверке
+        self._seen_news: "OrderedDict[str, tuple]" = OrderedDict()
+        self._load_state()
         
         # Пороги для уведомлений
         self.thresholds = {
@@ -50,15 +179,29 @@ class AIMarketMonitor:
         # Отправляем приветственное сообщение
         await self._send_startup_message()
         
-        while True:
-            try:
-                await self.check_market()
-            except Exception as e:
-                logger.error(f"Ошибка в мониторинге: {e}")
-            
-            # Ждём следующий цикл
-            logger.info(f"⏳ Следующая проверка через {self.check_interval/3600} часов")
-            await asyncio.sleep(self.check_interval)
+        try:
+            while True:
+                try:
+                    await self.check_market()
+                except Exception as e:
+                    logger.error(f"Ошибка в мониторинге: {e}")
+                self._save_state()
+                
+                # Ждём следующий цикл или внеочередной запуск через trigger_check()
+                logger.info(f"⏳ Следующая проверка через {self.check_interval/3600} часов")
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=self.check_interval)
+                except asyncio.TimeoutError:
+                    pass
+                self._wake.clear()
+        except asyncio.CancelledError:
+            self._save_state()
+            logger.info("🛑 Мониторинг остановлен")
+            raise
+    
+    def trigger_check(self):
+        """Запускает проверку рынка немедленно, не дожидаясь окончания интервала"""
+        self._wake.set()
     
     async def _send_startup_message(self):
         """Отправляет сообщение о запуске мониторинга"""
@@ -66,17 +209,7 @@ class AIMarketMonitor:
             logger.warning("⚠️ chat_id не указан, уведомления не будут отправляться")
             return
         
-        message = (
-            "🤖 *АВТОМАТИЧЕСКИЙ ИИ-МОНИТОРИНГ ЗАПУЩЕН*\n\n"
-            "Я буду следить за рынком 24/7 и присылать:\n"
-            "• 🚨 *Важные новости* (кризисы, рекорды, санкции)\n"
-            "• 📊 *Изменения настроений* рынка\n"
-            "• 💡 *Инвестиционные идеи* от ИИ\n"
-            "• ⚠️ *Предупреждения* о рисках\n\n"
-            f"🕒 Проверка каждые {self.check_interval/3600:.0f} час(а)\n"
-            "🔍 Анализ при появлении важных событий\n\n"
-            "Используй /monitor для управления"
-        )
+        message = STARTUP_TEMPLATE.format(hours=self.check_interval / 3600)
         
         try:
             await self.bot.send_message(
@@ -92,9 +225,11 @@ class AIMarketMonitor:
         """Проверяет рынок и отправляет уведомления"""
         
         logger.info("🔍 Проверка рынка...")
+        now = datetime.now()
+        now_mono = time.monotonic()
         
-        # 1. Собираем свежие новости
-        news = self.news_parser.fetch_all_news(limit_per_source=3, max_total=50)
+        # 1. Собираем свежие новости (в потоке, чтобы не блокировать event loop бота)
+        news = await asyncio.to_thread(self.news_parser.fetch_all_news, limit_per_source=3, max_total=50)
         current_news_count = len(news)
         
         logger.info(f"📰 Собрано {current_news_count} новостей")
@@ -114,11 +249,11 @@ class AIMarketMonitor:
             await self._send_sentiment_alert(current_sentiment)
         
         # 4. Проверяем, нужно ли сделать полный анализ
-        if self._should_do_full_analysis(news, current_sentiment):
+        if self._should_do_full_analysis(current_sentiment, now_mono):
             logger.info("🤖 Запуск полного ИИ-анализа...")
-            analysis = self.ai_advisor.analyze_all()
+            analysis = await asyncio.to_thread(self.ai_advisor.analyze_all)
             await self._send_market_analysis(analysis)
-            self.last_analysis_time = datetime.now()
+            self.last_analysis_at = now_mono
         
         # 5. Проверяем изменение количества новостей (активность)
         news_diff = current_news_count - self.last_news_count
@@ -128,75 +263,115 @@ class AIMarketMonitor:
         
         self.last_news_count = current_news_count
         self.last_sentiment = current_sentiment
-        self.last_check = datetime.now()
+        self.last_check = now
     
     def _find_important_news(self, news_list: List) -> List:
         """Находит важные новости для уведомления"""
         important = []
         
-        # Ключевые слова для важных новостей
-        important_keywords = {
-            'кризис': 1.0, 'обвал': 1.0, 'рекорд': 0.8, 'санкции': 1.0,
-            'дефолт': 1.0, 'слияние': 0.7, 'поглощение': 0.7, 'дивиденды': 0.6,
-            'отчетность': 0.5, 'иск': 0.6, 'штраф': 0.6, 'расследование': 0.6,
-            'назначение': 0.4, 'отставка': 0.5, 'теракт': 1.0, 'война': 1.0,
-            'катастрофа': 1.0, 'эмбарго': 0.9, 'забастовка': 0.6,
-            'банкротство': 0.9, 'национализация': 0.9, 'рекордный': 0.7
-        }
-        
         for news in news_list[:15]:  # Проверяем первые 15
-            title_lower = news.title.lower()
-            
-            for keyword, weight in important_keywords.items():
-                if keyword in title_lower:
-                    # Проверяем, не уведомляли ли уже
-                    news_hash = hash(news.title + news.link)
-                    if news_hash not in self.notified_events:
-                        self.notified_events.add(news_hash)
-                        
-                        # Добавляем вес важности
-                        news.importance = weight
-                        important.append(news)
-                        
-                        logger.info(f"🔥 Важная новость: {news.title[:50]}...")
-                        break
+            # Из всех найденных ключевых слов берём самое весомое
+            found = self._IMPORTANT_RE.findall(news.title_lower)
+            if found:
+                weight = max(map(self._IMPORTANT_KEYWORDS.__getitem__, found))
+                # Проверяем, не уведомляли ли уже
+                news_hash = self._event_key(news)
+                if news_hash not in self.notified_events:
+                    self._remember_event(news_hash)
+                    
+                    # Добавляем вес важности
+                    news.importance = weight
+                    important.append(news)
+                    
+                    logger.info(f"🔥 Важная новость: {news.title[:50]}...")
+                else:
+                    self.notified_events.move_to_end(news_hash)
         
         # Сортируем по важности
         important.sort(key=lambda x: x.importance, reverse=True)
+        self._last_important_count = len(important)
         return important
     
+    @staticmethod
+    def _event_key(news) -> str:
+        """Стабильный ключ новости (hash() строк меняется между запусками, а набор сохраняется на диск)"""
+        return hashlib.blake2b(f"{news.title}\n{news.link}".encode(), digest_size=8).hexdigest()
+    
+    def _remember_event(self, event_hash: str) -> None:
+        """Запоминает событие; самые старые вытесняются, чтобы набор не рос бесконечно"""
+        self.notified_events[event_hash] = None
+        if len(self.notified_events) > self.MAX_NOTIFIED_EVENTS:
+            self.notified_events.popitem(last=False)
+    
+    def _save_state(self):
+        """Сохраняет отправленные события, разобранные новости и последний сентимент, чтобы пережить перезапуск"""
+        try:
+            state = {
+                'notified_events': list(self.notified_events),
+                'seen_news': [(key, pos, neg) for key, (pos, neg) in self._seen_news.items()],
+                'last_sentiment': self.last_sentiment,
+            }
+            os.makedirs(os.path.dirname(self.STATE_FILE), exist_ok=True)
+            tmp_path = self.STATE_FILE + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                f.write(orjson.dumps(state))
+            os.replace(tmp_path, self.STATE_FILE)
+        except Exception as e:
+            logger.error(f"Ошибка сохранения состояния мониторинга: {e}")
+    
+    def _load_state(self):
+        """Загружает состояние мониторинга, сохранённое при прошлом запуске"""
+        try:
+            if os.path.exists(self.STATE_FILE):
+                with open(self.STATE_FILE, 'rb') as f:
+                    state = orjson.loads(f.read())
+                events = state.get('notified_events', [])[-self.MAX_NOTIFIED_EVENTS:]
+                self.notified_events = OrderedDict.fromkeys(events)
+                seen = state.get('seen_news', [])[-self.MAX_SEEN_NEWS:]
+                self._seen_news = OrderedDict((key, (pos, neg)) for key, pos, neg in seen)
+                self.last_sentiment = state.get('last_sentiment', self.last_sentiment)
+                logger.info(f"📂 Загружено {len(self.notified_events)} отправленных событий, "
+                            f"{len(self._seen_news)} разобранных новостей")
+        except Exception as e:
+            logger.error(f"Ошибка загрузки состояния мониторинга: {e}")
+    
     def _analyze_market_sentiment(self, news_list: List) -> float:
         """Анализирует общий сентимент рынка"""
         if not news_list:
             return self.last_sentiment
         
-        positive_words = ['рост', 'прибыль', 'успех', 'рекорд', 'повышение', 
-                         'увеличение', 'выигрыш', 'доход', 'дивиденды']
-        negative_words = ['падение', 'убыток', 'кризис', 'санкции', 'снижение',
-                         'обвал', 'потеря', 'долг', 'проблема']
-        
-        total_score = 0
-        news_analyzed = 0
-        
-        for news in news_list[:30]:  # Анализируем до 30 новостей
-            text = (news.title + " " + news.summary).lower()
-            
-            # Считаем позитивные и негативные слова
-            pos = sum(1 for w in positive_words if w in text)
-            neg = sum(1 for w in negative_words if w in text)
-            
-            # Учитываем важность источника
-            source_weight = 1.0
-            if news.source in ['interfax', 'tass', 'bloomberg', 'reuters']:
-                source_weight = 1.5
-            
-            if pos + neg > 0:
-                news_score = ((pos - neg) / (pos + neg)) * source_weight
-                total_score += news_score
-                news_analyzed += 1
-        
-        if news_analyzed > 0:
-            return total_score / news_analyzed
+        batch = news_list[:30]  # Анализируем до 30 новостей
+        pos = np.empty(len(batch), dtype=np.int64)
+        neg = np.empty(len(batch), dtype=np.int64)
+        
+        # Для уже встречавшихся ссылок счётчики берём из памяти, остальные тексты считаем одним пакетом
+        keys = [news.link or news.title for news in batch]
+        fresh = []
+        for i, key in enumerate(keys):
+            counts = self._seen_news.get(key)
+            if counts is None:
+                fresh.append(i)
+            else:
+                self._seen_news.move_to_end(key)
+                pos[i], neg[i] = counts
+        
+        if fresh:
+            texts = np.array([batch[i].text_lower for i in fresh])
+            pos[fresh] = _count_present(texts, self._POSITIVE_WORDS)
+            neg[fresh] = _count_present(texts, self._NEGATIVE_WORDS)
+            for i in fresh:
+                self._seen_news[keys[i]] = (int(pos[i]), int(neg[i]))
+            while len(self._seen_news) > self.MAX_SEEN_NEWS:
+                self._seen_news.popitem(last=False)
+        
+        # Учитываем важность источника
+        high_weight = np.fromiter((news.source in self._HIGH_WEIGHT_SOURCES for news in batch),
+                                  dtype=bool, count=len(batch))
+        weights = 1.0 + 0.5 * high_weight
+        
+        score = _sentiment_score(pos, neg, weights)
+        if not np.isnan(score):
+            return float(score)
         
         return self.last_sentiment
     
@@ -206,18 +381,15 @@ class AIMarketMonitor:
             return True
         return False
     
-    def _should_do_full_analysis(self, news_list: List, current_sentiment: float) -> bool:
-        """Определяет, нужно ли сделать полный анализ"""
-        hours_since = (datetime.now() - self.last_analysis_time).total_seconds() / 3600
-        
+    def _should_do_full_analysis(self, current_sentiment: float, now_mono: float) -> bool:
+        """Определяет, нужно ли сделать полный анализ (now_mono — time.monotonic() текущей проверки)"""
         # Полный анализ если:
         # 1. Прошло больше 6 часов
-        if hours_since >= 6:
+        if now_mono - self.last_analysis_at >= self.FULL_ANALYSIS_INTERVAL:
             return True
         
         # 2. Много новых важных новостей
-        important_count = len([n for n in news_list if hasattr(n, 'importance')])
-        if important_count >= 5:
+        if self._last_important_count >= 5:
             return True
         
         # 3. Резкое изменение сентимента
@@ -232,7 +404,9 @@ class AIMarketMonitor:
             logger.info(f"🚨 Важные новости: {len(news_list)}")
             return
         
-        for news in news_list[:2]:  # Максимум 2 новости за раз
+        sem = asyncio.Semaphore(self.SEND_CONCURRENCY)
+        
+        async def send(news):
             # Выбираем эмодзи по важности
             if news.importance >= 0.9:
                 emoji = "🚨🚨🚨"
@@ -241,24 +415,34 @@ class AIMarketMonitor:
             else:
                 emoji = "🚨"
             
-            message = (
-                f"{emoji} *СРОЧНАЯ НОВОСТЬ*\n\n"
-                f"📰 *{news.title}*\n"
-                f"📍 Источник: {news.source}\n"
-                f"🕒 {news.published.strftime('%H:%M %d.%m.%Y')}\n"
-                f"🔗 [Читать]({news.link})"
+            message = IMPORTANT_NEWS_TEMPLATE.format(
+                emoji=emoji,
+                title=news.title,
+                source=news.source,
+                published=_format_published(news.published),
+                link=news.link
             )
             
-            try:
-                await self.bot.send_message(
-                    chat_id=self.chat_id,
-                    text=message,
-                    parse_mode='Markdown',
-                    disable_web_page_preview=True
-                )
-                await asyncio.sleep(2)  # Пауза между сообщениями
-            except Exception as e:
-                logger.error(f"Ошибка отправки: {e}")
+            async with sem:
+                try:
+                    await self._send_message(
+                        text=message,
+                        parse_mode='Markdown',
+                        disable_web_page_preview=True
+                    )
+                except Exception as e:
+                    logger.error(f"Ошибка отправки: {e}")
+        
+        await asyncio.gather(*(send(news) for news in news_list[:2]))  # Максимум 2 новости за раз
+    
+    async def _send_message(self, **kwargs):
+        """send_message в чат мониторинга; ждём только если Telegram сам попросил (RetryAfter)"""
+        try:
+            return await self.bot.send_message(chat_id=self.chat_id, **kwargs)
+        except RetryAfter as e:
+            logger.warning(f"Telegram просит подождать {e.retry_after} сек")
+            await asyncio.sleep(e.retry_after)
+            return await self.bot.send_message(chat_id=self.chat_id, **kwargs)
     
     async def _send_sentiment_alert(self, sentiment: float):
         """Отправляет alert об изменении сентимента"""
@@ -275,13 +459,7 @@ class AIMarketMonitor:
         
         change = sentiment - self.last_sentiment
         
-        message = (
-            f"{emoji} *ИЗМЕНЕНИЕ РЫНОЧНЫХ НАСТРОЕНИЙ*\n\n"
-            f"Тренд: {trend}\n"
-            f"Текущий сентимент: {sentiment:.2f}\n"
-            f"Изменение: {change:+.2f}\n\n"
-            f"💡 Используй /advice для детального анализа"
-        )
+        message = SENTIMENT_TEMPLATE.format(emoji=emoji, trend=trend, sentiment=sentiment, change=change)
         
         await self.bot.send_message(
             chat_id=self.chat_id,
@@ -295,8 +473,7 @@ class AIMarketMonitor:
             logger.info("🤖 Полный анализ рынка выполнен")
             return
         
-        message = "🤖 *АВТОМАТИЧЕСКИЙ АНАЛИЗ РЫНКА*\n\n"
-        message += self.ai_advisor.format_advice_message(analysis)
+        message = MARKET_ANALYSIS_HEADER + self.ai_advisor.format_advice_message(analysis)
         
         try:
             await self.bot.send_message(
@@ -314,18 +491,9 @@ class AIMarketMonitor:
             return
         
         if diff > 0:
-            message = (
-                f"📊 *ПОВЫШЕННАЯ АКТИВНОСТЬ*\n\n"
-                f"За последний час появилось {diff} новых новостей\n"
-                f"Всего в ленте: {news_count}\n\n"
-                f"Рекомендую проверить /news"
-            )
+            message = ACTIVITY_UP_TEMPLATE.format(diff=diff, count=news_count)
         else:
-            message = (
-                f"📊 *СНИЖЕНИЕ АКТИВНОСТИ*\n\n"
-                f"Новостей стало на {abs(diff)} меньше\n"
-                f"Всего в ленте: {news_count}"
-            )
+            message = ACTIVITY_DOWN_TEMPLATE.format(diff=abs(diff), count=news_count)
         
         await self.bot.send_message(
             chat_id=self.chat_id,
@@ -338,4 +506,5 @@ class AIMarketMonitor:
 async def start_monitoring(bot, chat_id: Optional[int] = None):
     """Запускает мониторинг для бота"""
     monitor = AIMarketMonitor(bot, chat_id)
+    services.set_service('ai_monitor', monitor)  # чтобы /monitor now мог разбудить цикл
     await monitor.start_monitoring()
\ No newline at end of file
@@ -3,33 +3,159 @@
 Управляет виртуальным портфелем на основе рекомендаций ИИ
 """
 
+import asyncio
 import logging
+from dataclasses import dataclass
 from datetime import datetime, timedelta
 from typing import Dict, List, Any, Optional
-import json
+import math
 import os
+import sqlite3
+import threading
 import time
 import services
-from collections import defaultdict
-from config import TINKOFF_TOKEN
+import httpx
+import orjson
+from collections import OrderedDict, deque
+from itertools import islice
+import numpy as np
 import pandas as pd
+from jit_utils import njit, NUMBA_AVAILABLE  # без numba используется векторный вариант на NumPy
+from indicators import sma, rsi_from_changes
 
 logger = logging.getLogger(__name__)
 
+@njit("Tuple((float64[:], boolean[:]))(float64[:], float64[:], float64)", cache=True)
+def _scan_positions(avg_price, cur_price, stop_loss_pct):
+    """Доходность позиций в % и флаги стоп-лосса; нет цены или средней — NaN и без стопа."""
+    n = avg_price.shape[0]
+    pct = np.empty(n, dtype=np.float64)
+    stop = np.zeros(n, dtype=np.bool_)
+    for i in range(n):
+        if avg_price[i] == 0.0:
+            pct[i] = np.nan
+        else:
+            pct[i] = (cur_price[i] - avg_price[i]) / avg_price[i] * 100.0
+            stop[i] = pct[i] < stop_loss_pct
+    return pct, stop
+
+
+def _scan_positions_vectorized(avg_price: np.ndarray, cur_price: np.ndarray, stop_loss_pct: float):
+    """То же, что _scan_positions, на векторных операциях NumPy (когда numba не установлена)."""
+    pct = np.divide((cur_price - avg_price) * 100.0, avg_price,
+                    out=np.full(avg_price.shape[0], np.nan), where=avg_price != 0)
+    # Сравнение с NaN ложно, поэтому позиции без цены стоп-лосс не дают
+    return pct, pct < stop_loss_pct
+
+
+RSI_PERIOD = 14
+
+
+def _fmt_ts(ts: float) -> str:
+    """Время сделки (unix time) в виде 'ДД.ММ.ГГ ЧЧ:ММ'"""
+    return time.strftime('%d.%m.%y %H:%M', time.localtime(ts))
+
+
+def _with_ts(trade: Dict) -> Dict:
+    """Сделки старого формата хранили ISO-строку в 'timestamp'; приводим к числовому 'ts'"""
+    if 'ts' not in trade and 'timestamp' in trade:
+        try:
+            trade['ts'] = datetime.fromisoformat(str(trade.pop('timestamp'))).timestamp()
+        except ValueError:
+            trade['ts'] = 0.0
+    return trade
+
+
+def _last(items: deque, count: int) -> List:
+    """Последние count элементов deque по порядку (срезы deque не поддерживает)"""
+    return list(islice(reversed(items), count))[::-1]
+
+
+# Шаблоны сообщения о портфеле: постоянный текст задан один раз, подставляются только значения
+_PORTFOLIO_HEADER = (
+    "💰 *ВИРТУАЛЬНЫЙ ПОРТФЕЛЬ*\n\n"
+    "💵 Баланс: {balance:,.0f} ₽\n"
+    "📊 Инвестировано: {invested:,.0f} ₽\n"
+    "🏦 Всего: {total_value:,.0f} ₽\n\n"
+    "{profit_emoji} *Общая доходность:* {total_profit:+,.0f} ₽ ({total_profit_percent:+.1f}%)\n"
+)
+_POSITION_LINE = (
+    "{emoji} *{ticker}*: {shares} шт × {current_price:.2f} = {current_value:,.0f} ₽\n"
+    "   Средняя: {avg_price:.2f} | {emoji} {profit:+,.0f} ({profit_percent:+.1f}%)"
+)
+_BUY_LINE = "🟢 {date} BUY {shares} {ticker} @ {price:.2f}"
+_SELL_LINE = "{emoji} {date} SELL {shares} {ticker} @ {price:.2f} ({profit:+,.0f})"
+
+_TRADE_COLUMNS = "ts, ticker, action, shares, price, amount, fee, profit, confidence, balance_after, reason"
+_INSERT_TRADE_SQL = f"INSERT INTO trades ({_TRADE_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+
+
+def _trade_row(trade: Dict) -> tuple:
+    """Сделка -> строка таблицы trades (amount — стоимость покупки или выручка продажи)"""
+    return (
+        trade['ts'], trade['ticker'], trade['action'], trade['shares'], trade['price'],
+        trade.get('cost', trade.get('revenue')), trade.get('fee'), trade.get('profit'),
+        trade.get('confidence'), trade.get('balance_after'), trade.get('reason'),
+    )
+
+
+def _trade_from_row(row: tuple) -> Dict:
+    """Строка таблицы trades -> сделка в том же виде, в каком её создают _buy/_sell"""
+    ts, ticker, action, shares, price, amount, fee, profit, confidence, balance_after, reason = row
+    trade = {'ts': ts, 'ticker': ticker, 'action': action, 'shares': shares, 'price': price,
+             'cost' if action == 'BUY' else 'revenue': amount, 'fee': fee}
+    if profit is not None:
+        trade['profit'] = profit
+    trade['confidence'] = confidence
+    trade['balance_after'] = balance_after
+    if reason is not None:
+        trade['reason'] = reason
+    return trade
+
+
+@dataclass(slots=True)
+class Position:
+    """Позиция в словарном представлении портфеля (VirtualTrader.portfolio)"""
+    shares: int
+    avg_price: float
+
+
 class VirtualTrader:
     """Автономный трейдер с виртуальным портфелем"""
     
+    PRICE_CONCURRENCY = 16
+    PRICE_SNAPSHOT_TTL = 30  # сек: все вызовы _get_current_prices за цикл получают один снимок цен
+    DEFAULT_TICKERS = frozenset({'SBER', 'GAZP', 'YDEX', 'VTBR', 'TATN', 'LKOH'})  # цены нужны всегда
+    
+    STATE_DB_PATH = 'data/trader.db'              # сделки, позиции и баланс (SQLite, WAL)
+    SNAPSHOT_PATH = 'data/trader_snapshot.json'   # история доходности и флаги, перезаписывается целиком
+    TRADES_LOG_PATH = 'data/trades.ndjson'        # журнал сделок прежней версии, переносится в БД
+    LEGACY_STATE_PATH = 'data/trader_state.json'  # самый старый формат, тоже переносится в БД
+    TRADES_TAIL = 100                             # сколько последних сделок поднимать в память
+    
+    MAX_TRADES = 2000
+    MAX_PERFORMANCE_HISTORY = 100
+    MAX_AI_DECISIONS = 50
+    MAX_HISTORY_CACHE = 128  # тикеров с историей цен в памяти
+    
     def __init__(self, initial_balance: float = 1000000):
         self.ai_advisor = services.ai_advisor()
         self.stock_provider = services.stock_provider()
+        self.db = services.db()  # общая БД новостей/сделок; берём один раз, а не на каждую сделку
 
         self.initial_balance = initial_balance
         self.balance = initial_balance
+        # Портфель хранится параллельными массивами (SoA); self.portfolio — словарное представление
         self.portfolio = {}
 
-        self.trades = []
-        self.performance_history = []
-        self.ai_decisions = []
+        # Ограниченные очереди: старые записи вытесняются сами, память не растёт при долгой работе
+        self.trades = deque(maxlen=self.MAX_TRADES)
+        self.performance_history = deque(maxlen=self.MAX_PERFORMANCE_HISTORY)
+        self.ai_decisions = deque(maxlen=self.MAX_AI_DECISIONS)
+        self._state_lock = threading.Lock()
+        self._state_db = self._open_state_db()
+        self._portfolio_lock = threading.RLock()  # позиции и баланс меняет торговый поток, а читает бот
+        self._cycle_lock = threading.Lock()  # один торговый цикл за раз (авто-торговля и /traderanalyze)
 
         # ===== НОВЫЕ АГРЕССИВНЫЕ НАСТРОЙКИ =====
         self.max_position_size = 0.45          # макс доля одной акции (было 0.35)
@@ -40,13 +166,21 @@ class VirtualTrader:
         # Параметры трейлинг-стопа
         self.use_trailing_stop = True
         self.trailing_stop_pct = 5.0  # откат от максимума в %
+        self.stop_loss_pct = -5.0     # обычный стоп-лосс от средней цены в %
 
         self.highest_price = {}  # для трейлинг-стопа
 
-        self.price_history_cache = {}  # ticker -> (timestamp, DataFrame)
+        self.price_history_cache: "OrderedDict[str, tuple]" = OrderedDict()  # ticker -> (timestamp, DataFrame), LRU
         self.history_cache_ttl = 3600  # 1 час
 
+        # Снимок текущих цен: за торговый цикл цены запрашиваются один раз, а не в каждом методе
+        self._price_cache: Dict[str, float] = {}
+        self._price_cache_ts = 0.0
+        self._price_cache_tickers = frozenset()  # для каких тикеров делался запрос
+
         self.is_trading = True
+        self._dirty = False  # снимок (история доходности, флаг торговли) изменился с последнего сохранения
+        self._stop_event = threading.Event()  # будит цикл start_auto_trading сразу при остановке
         self.last_analysis = None
         self.daily_pnl = 0
 
@@ -58,9 +192,58 @@ class VirtualTrader:
         self.sell_ma20_break = True             # продавать всё при пробое MA20 вниз
 
         self._load_state()
-        self.start_trading()
+        # Первый торговый цикл запускает start_auto_trading в своём потоке: конструктор
+        # вызывается и из цикла событий бота (services.ai_trader() в main, обработчики)
+        self.start_trading(analyze_now=False)
         logger.info(f"💰 VirtualTrader инициализирован. Баланс: {self.balance:,.0f} ₽")
 
+    @property
+    def portfolio(self) -> Dict[str, Position]:
+        """Портфель в словарном виде {ticker: Position}; собирается по запросу (внешние модули, миграция)"""
+        tickers, shares, avg_price, _ = self._positions_snapshot()
+        return {
+            ticker: Position(sh, ap)
+            for ticker, sh, ap in zip(tickers, shares.tolist(), avg_price.tolist())
+        }
+
+    def get_position(self, ticker: str) -> Optional[Position]:
+        """Одна позиция без сборки всего словаря portfolio; None, если её нет"""
+        with self._portfolio_lock:
+            i = self._ticker_idx.get(ticker)
+            if i is None:
+                return None
+            return Position(int(self._shares[i]), float(self._avg_price[i]))
+
+    def _positions_snapshot(self):
+        """Согласованный снимок (тикеры, количество, средние цены, баланс) для чтения из другого потока"""
+        with self._portfolio_lock:
+            return self._tickers, self._shares.copy(), self._avg_price.copy(), self.balance
+
+    @portfolio.setter
+    def portfolio(self, value: Dict[str, Any]):
+        # Значения — Position или словари {'shares', 'avg_price'} из JSON прежних версий
+        positions = [p if isinstance(p, Position) else Position(p['shares'], p['avg_price']) for p in value.values()]
+        self._tickers: List[str] = list(value)
+        self._ticker_idx: Dict[str, int] = {ticker: i for i, ticker in enumerate(self._tickers)}
+        self._shares = np.fromiter((p.shares for p in positions), dtype=np.int64, count=len(positions))
+        self._avg_price = np.fromiter((p.avg_price for p in positions), dtype=np.float64, count=len(positions))
+
+    def _add_position(self, ticker: str, shares: int, avg_price: float):
+        """Открывает новую позицию в конце массивов"""
+        self._ticker_idx[ticker] = len(self._tickers)
+        self._tickers = self._tickers + [ticker]
+        self._shares = np.append(self._shares, np.int64(shares))
+        self._avg_price = np.append(self._avg_price, float(avg_price))
+
+    def _remove_position(self, ticker: str):
+        """Закрывает позицию; порядок остальных сохраняется, как при удалении из словаря"""
+        i = self._ticker_idx.pop(ticker)
+        self._tickers = self._tickers[:i] + self._tickers[i + 1:]
+        self._shares = np.delete(self._shares, i)
+        self._avg_price = np.delete(self._avg_price, i)
+        for other in self._tickers[i:]:
+            self._ticker_idx[other] -= 1
+
     def _get_history_df(self, ticker: str, days: int = 30) -> Optional[pd.DataFrame]:
         """Получает исторические цены и возвращает DataFrame с индикаторами."""
         now = datetime.now()
@@ -68,10 +251,18 @@ class VirtualTrader:
         if ticker in self.price_history_cache:
             cache_time, df = self.price_history_cache[ticker]
             if (now - cache_time).total_seconds() < self.history_cache_ttl:
+                self.price_history_cache.move_to_end(ticker)
+                return df
+
+            # Кэш устарел: дозапрашиваем только последние бары (текущий день мог измениться)
+            lookback = (now - cache_time).days + 2
+            if lookback < days:
+                df = self._extend_history_df(ticker, df, lookback, days)
+                self._cache_history(ticker, now, df)
                 return df
 
         # Запрашиваем через stock_provider
-        history = self.stock_provider.get_history(ticker, days=days)
+        history = self.stock_provider.get_history(ticker, days=days, use_cache=False)  # кэш здесь свой
         if not history or len(history) < 20:
             return None
 
@@ -80,20 +271,78 @@ class VirtualTrader:
         df.sort_index(inplace=True)
 
         # Рассчитываем индикаторы
-        df['MA5'] = df['close'].rolling(window=5).mean()
-        df['MA20'] = df['close'].rolling(window=20).mean()
-
-        # RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-        rs = gain / loss
-        df['RSI'] = 100 - (100 / (1 + rs))
+        self._fill_indicators(df)
 
         # Сохраняем в кэш
-        self.price_history_cache[ticker] = (now, df)
+        self._cache_history(ticker, now, df)
         return df
 
+    def _cached_indicators(self, ticker: str) -> Optional[tuple]:
+        """Последние (MA5, MA20, RSI) из кэша историй без запросов к API; None — кэша нет или он устарел"""
+        entry = self.price_history_cache.get(ticker)
+        if entry is None:
+            return None
+        cache_time, df = entry
+        if (datetime.now() - cache_time).total_seconds() >= self.history_cache_ttl:
+            return None
+        self.price_history_cache.move_to_end(ticker)
+        return df['MA5'].iat[-1], df['MA20'].iat[-1], df['RSI'].iat[-1]
+
+    def _cache_history(self, ticker: str, now: datetime, df: pd.DataFrame):
+        """Кладёт историю в кэш; давно не запрашивавшиеся тикеры вытесняются"""
+        self.price_history_cache[ticker] = (now, df)
+        self.price_history_cache.move_to_end(ticker)
+        while len(self.price_history_cache) > self.MAX_HISTORY_CACHE:
+            self.price_history_cache.popitem(last=False)
+
+    def _extend_history_df(self, ticker: str, df: pd.DataFrame, lookback: int, days: int) -> pd.DataFrame:
+        """Дописывает к закэшированной истории свежие бары; индикаторы считаются только для них"""
+        history = self.stock_provider.get_history(ticker, days=lookback, use_cache=False)
+        if not history:
+            return df  # новых баров нет (выходные) или API недоступен — остаёмся на старых данных
+
+        new = pd.DataFrame(history)
+        new.set_index('time', inplace=True)
+        new.sort_index(inplace=True)
+
+        # Бары, начиная с первого свежего, заменяем новыми
+        old = df[df.index < new.index[0]]
+        merged = pd.concat([old, new])
+        self._fill_indicators(merged, start=len(old))
+
+        # Окно истории то же, что при полном запросе
+        return merged[merged.index >= merged.index[-1] - timedelta(days=days)]
+
+    @staticmethod
+    def _fill_indicators(df: pd.DataFrame, start: int = 0):
+        """
+        Считает MA5/MA20/RSI для строк начиная с start. Скользящие средние берут только нужный хвост цен,
+        RSI (по Уайлдеру) продолжает сглаживание со средних прироста/падения, сохранённых в строке start-1.
+        """
+        closes = df['close'].to_numpy(dtype=np.float64)
+        offset = max(0, start - 20)
+        ma5 = sma(closes[offset:], 5)[start - offset:]
+        ma20 = sma(closes[offset:], 20)[start - offset:]
+
+        # RSI
+        if start:
+            delta = closes[start:] - closes[start - 1:-1]
+            seed_gain = float(df['RSI_GAIN'].iat[start - 1])
+            seed_loss = float(df['RSI_LOSS'].iat[start - 1])
+        else:
+            delta = np.diff(closes, prepend=closes[:1])  # у первого бара изменения нет
+            seed_gain = seed_loss = 0.0
+        rsi, avg_gain, avg_loss = rsi_from_changes(delta, seed_gain, seed_loss, RSI_PERIOD)
+        # Пока не набралось RSI_PERIOD баров, RSI не определён
+        if start < RSI_PERIOD:
+            rsi[:RSI_PERIOD - start] = np.nan
+
+        for name, values in (('MA5', ma5), ('MA20', ma20),
+                             ('RSI', rsi), ('RSI_GAIN', avg_gain), ('RSI_LOSS', avg_loss)):
+            if name not in df.columns:
+                df[name] = np.nan
+            df.iloc[start:, df.columns.get_loc(name)] = values
+
     # def _check_technical_filters(self, ticker: str, current_price: float) -> tuple[bool, float, str]:
     #     """
     #     Проверяет технические фильтры для входа.
@@ -138,10 +387,9 @@ class VirtualTrader:
         if df is None or df.empty:
             return False, 0.0, "нет данных"
 
-        last = df.iloc[-1]
-        rsi = last.get('RSI')
+        rsi = df['RSI'].iat[-1]
 
-        if pd.isna(rsi):
+        if math.isnan(rsi):
             return False, 0.0, "нет RSI"
 
         # Условие: RSI < 70
@@ -153,64 +401,93 @@ class VirtualTrader:
 
         return rsi_ok, tech_conf, reason
 
-    def start_trading(self):
-        """Запускает автономную торговлю"""
+    def start_trading(self, analyze_now: bool = True):
+        """
+        Запускает автономную торговлю. Немедленный анализ синхронный и долгий:
+        из обработчиков бота вызывать через asyncio.to_thread.
+        """
         self.is_trading = True
+        self._dirty = True
+        self._stop_event.clear()
         logger.info("🚀 Автономная торговля запущена")
         
         # Немедленный анализ
-        self.analyze_and_trade()
+        if analyze_now:
+            self.analyze_and_trade()
     
     def stop_trading(self):
         """Останавливает автономную торговлю"""
         self.is_trading = False
+        self._dirty = True
+        self._stop_event.set()
         logger.info("⏹️ Автономная торговля остановлена")
         self._save_state()
     
     def analyze_and_trade(self):
-        """Анализирует рынок и совершает сделки"""
+        """
+        Анализирует рынок и совершает сделки (синхронная обёртка для потока авто-торговли).
+        Внутри работающего цикла событий не вызывать: там нужен await analyze_and_trade_async().
+        """
+        asyncio.run(self.analyze_and_trade_async())
+
+    async def analyze_and_trade_async(self):
+        """Анализирует рынок и совершает сделки, не блокируя цикл событий бота"""
         if not self.is_trading:
             return
         
         logger.info("🤖 ИИ анализирует рынок для принятия решений...")
         
-        # Получаем анализ от ИИ
-        analysis = self.ai_advisor.analyze_all()
+        # Анализ ИИ и снимок цен на весь цикл запрашиваем одновременно
+        tickers = self.DEFAULT_TICKERS.union(self._tickers)
+        analysis, current_prices = await asyncio.gather(
+            asyncio.to_thread(self.ai_advisor.analyze_all),
+            self._get_current_prices_async(tickers),
+        )
+        self._remember_prices(current_prices, tickers)
         self.last_analysis = analysis
         
-        # Запоминаем решение ИИ
-        self.ai_decisions.append({
-            'timestamp': datetime.now(),
-            'analysis': analysis,
-            'portfolio_before': self.get_portfolio_summary()
-        })
-        
-        # Принимаем торговые решения на основе анализа
-        self._execute_trades(analysis)
-        
-        # Обновляем статистику
-        self._update_performance()
+        # Сделки и истории цен для технических сигналов — синхронный код, уводим в поток
+        await asyncio.to_thread(self._trade_cycle, analysis, current_prices)
+
+    def _trade_cycle(self, analysis: Dict, current_prices: Dict[str, float]):
+        """Торговая часть цикла по готовому анализу и снимку цен"""
+        with self._cycle_lock:
+            # Запоминаем решение ИИ
+            self.ai_decisions.append({
+                'ts': time.time(),
+                'analysis': analysis,
+                'portfolio_before': self.get_portfolio_summary(current_prices)
+            })
+            
+            # Принимаем торговые решения на основе анализа
+            self._execute_trades(analysis, current_prices)
+            
+            # Обновляем статистику
+            self._update_performance(current_prices)
         
         logger.info(f"✅ Торговый цикл завершён. Баланс: {self.balance:,.0f} ₽")
 
-    def _execute_trades(self, analysis: Dict):
+    def _execute_trades(self, analysis: Dict, current_prices: Optional[Dict[str, float]] = None):
         """Выполняет сделки на основе анализа ИИ – агрессивная версия с тех. фильтрами."""
         
-        current_prices = self._get_current_prices()
+        if current_prices is None:
+            current_prices = self._get_current_prices()
         if not current_prices:
             logger.warning("Нет текущих цен, пропускаем торговлю")
             return
 
         # Собираем кандидатов (до 7)
         candidates = []
+        seen_tickers = set()
 
         # Из top_picks (если есть)
         for pick in analysis.get('top_picks', [])[:7]:
             ticker = pick.get('ticker')
             action = pick.get('action', 'HOLD')
             confidence = pick.get('confidence', 0.5)
-            if action in ('BUY', 'HOLD') and ticker in current_prices:
+            if action in ('BUY', 'HOLD') and ticker in current_prices and ticker not in seen_tickers:
                 candidates.append((ticker, confidence, action))
+                seen_tickers.add(ticker)
 
         # Добавляем главную рекомендацию, если её нет
         main_ticker = analysis.get('top_pick')
@@ -218,7 +495,7 @@ class VirtualTrader:
         main_conf = analysis.get('confidence', 0.5)
         if (main_action in ('BUY', 'HOLD') and main_ticker and 
             main_ticker in current_prices and 
-            not any(t for t, _, _ in candidates if t == main_ticker)):
+            main_ticker not in seen_tickers):
             candidates.append((main_ticker, main_conf, main_action))
 
         if not candidates:
@@ -230,17 +507,27 @@ class VirtualTrader:
         candidates = candidates[:7]
 
         # === РАСПРЕДЕЛЕНИЕ КАПИТАЛА ===
-        buy_candidates = [(t, c) for t, c, a in candidates if a == 'BUY' and c >= self.min_confidence]
-        hold_candidates = [(t, c) for t, c, a in candidates if a == 'HOLD' and c >= 0.8]
-
-        total_conf_buy = sum(c for _, c in buy_candidates)
-        total_conf_hold = sum(c for _, c in hold_candidates)
+        # Один проход: покупки по BUY и докупки по уверенным HOLD вместе с суммами уверенности
+        buy_candidates = []
+        hold_candidates = []
+        total_conf_buy = total_conf_hold = 0
+        for ticker, conf, action in candidates:
+            if action == 'BUY':
+                if conf >= self.min_confidence:
+                    buy_candidates.append((ticker, conf))
+                    total_conf_buy += conf
+            elif conf >= 0.8:
+                hold_candidates.append((ticker, conf))
+                total_conf_hold += conf
 
         invest_capital = self.balance * 0.8
         if invest_capital < 1000:
             logger.info("Слишком мало средств для инвестиций")
             return
 
+        # Стоимость портфеля считаем один раз; покупка меняет её только на комиссию
+        portfolio_value = self.get_portfolio_value(current_prices)
+
         # === ПОКУПКИ ПО BUY ===
         if buy_candidates:
             for ticker, conf in buy_candidates:
@@ -259,13 +546,15 @@ class VirtualTrader:
                 # Корректируем сумму пропорционально отношению уверенностей
                 amount = base_amount * (adj_conf / conf) if conf > 0 else base_amount
                 logger.debug(f"{ticker}: BUY orig_conf={conf:.2f}, tech_conf={tech_conf:.2f}, adj_conf={adj_conf:.2f}, amount={amount:,.0f}")
-                self._buy(ticker, price, adj_conf, max_amount=amount)
+                trade = self._buy(ticker, price, adj_conf, max_amount=amount, portfolio_value=portfolio_value)
+                if trade:
+                    portfolio_value -= trade['fee']
 
         # === ДОКУПКИ ПО HOLD ===
         if hold_candidates:
             hold_budget = invest_capital * 0.2
             for ticker, conf in hold_candidates:
-                if ticker not in self.portfolio:
+                if ticker not in self._ticker_idx:
                     continue
                 price = current_prices[ticker]
 
@@ -279,30 +568,26 @@ class VirtualTrader:
                 base_amount = hold_budget * share
                 amount = base_amount * (adj_conf / conf) if conf > 0 else base_amount
                 logger.debug(f"{ticker}: HOLD orig_conf={conf:.2f}, tech_conf={tech_conf:.2f}, adj_conf={adj_conf:.2f}, amount={amount:,.0f}")
-                self._buy(ticker, price, adj_conf, max_amount=amount)
+                trade = self._buy(ticker, price, adj_conf, max_amount=amount, portfolio_value=portfolio_value)
+                if trade:
+                    portfolio_value -= trade['fee']
 
         # Проверка стоп-лоссов и тейк-профитов
         self._check_positions(current_prices)
 
-    def _process_recommendation(self, ticker: str, action: str, price: float, confidence: float):
-        """Обрабатывает одну рекомендацию"""
-        
-        if action == 'BUY':
-            self._buy(ticker, price, confidence)
-        elif action == 'SELL':
-            self._sell(ticker, price, confidence)
-        elif action == 'HOLD':
-            # Для HOLD ничего не делаем, но можем докупить если уверенность высокая
-            if confidence > 0.9:
-                self._buy(ticker, price, confidence * 0.8)
-    
-    def _buy(self, ticker: str, price: float, confidence: float, max_amount: Optional[float] = None):
-        """Покупает акции с ограничением по сумме"""
+    def _buy(self, ticker: str, price: float, confidence: float, max_amount: Optional[float] = None,
+             portfolio_value: Optional[float] = None) -> Optional[Dict]:
+        """Покупает акции с ограничением по сумме; возвращает сделку или None.
+        portfolio_value — уже посчитанная стоимость портфеля, чтобы не запрашивать цены заново."""
+        if not price > 0:
+            logger.warning(f"⚠️ {ticker}: некорректная цена {price}, покупка пропущена")
+            return
         
-        current_value = self.get_portfolio_value()
+        current_value = portfolio_value if portfolio_value is not None else self.get_portfolio_value()
         max_position_value = current_value * self.max_position_size
         
-        current_position_value = self.portfolio.get(ticker, {}).get('shares', 0) * price
+        i = self._ticker_idx.get(ticker)
+        current_position_value = (int(self._shares[i]) if i is not None else 0) * price
         if current_position_value >= max_position_value:
             logger.info(f"⏸️ {ticker}:достигнут максимальный размер позиции")
             return
@@ -322,12 +607,12 @@ class VirtualTrader:
             logger.info(f"⏸️ {ticker}: сумма слишком мала для покупки")
             return
 
-        shares = int(available / price)
+        shares = int(available // price)
         cost = shares * price
         fee = cost * self.trade_fee
 
         if cost + fee > self.balance:
-            shares = int((self.balance * 0.9) / price)
+            shares = int(self.balance * 0.9 // price)
             cost = shares * price
             fee = cost * self.trade_fee
 
@@ -335,19 +620,21 @@ class VirtualTrader:
             return
 
         # Совершаем покупку
-        self.balance -= (cost + fee)
-
-        if ticker in self.portfolio:
-            old_shares = self.portfolio[ticker]['shares']
-            old_cost = old_shares * self.portfolio[ticker]['avg_price']
-            new_shares = old_shares + shares
-            new_avg_price = (old_cost + cost) / new_shares
-            self.portfolio[ticker] = {'shares': new_shares, 'avg_price': new_avg_price}
-        else:
-            self.portfolio[ticker] = {'shares': shares, 'avg_price': price}
+        with self._portfolio_lock:
+            self.balance -= (cost + fee)
+
+            i = self._ticker_idx.get(ticker)
+            if i is not None:
+                old_shares = int(self._shares[i])
+                old_cost = old_shares * float(self._avg_price[i])
+                new_shares = old_shares + shares
+                self._shares[i] = new_shares
+                self._avg_price[i] = (old_cost + cost) / new_shares
+            else:
+                self._add_position(ticker, shares, price)
 
         trade = {
-            'timestamp': datetime.now(),
+            'ts': time.time(),
             'ticker': ticker,
             'action': 'BUY',
             'shares': shares,
@@ -358,19 +645,21 @@ class VirtualTrader:
             'balance_after': self.balance
         }
         self.trades.append(trade)
+        self._record_trade(trade)
 
-        db = services.db()
-        if db:
-            db.save_trade(trade)
+        if self.db:
+            self.db.save_trade(trade)
 
         logger.info(f"🟢 BUY {shares} {ticker} @ {price:.2f} = {cost:,.0f} ₽ (fee: {fee:.0f})")
+        return trade
 
     def _sell(self, ticker: str, price: float, confidence: float, reason: str = 'manual', shares: Optional[int] = None, sell_all: bool = False):
-        if ticker not in self.portfolio:
+        i = self._ticker_idx.get(ticker)
+        if i is None:
             return
 
-        total_shares = self.portfolio[ticker]['shares']
-        avg_price = self.portfolio[ticker]['avg_price']
+        total_shares = int(self._shares[i])
+        avg_price = float(self._avg_price[i])
 
         if sell_all:
             sell_shares = total_shares
@@ -392,18 +681,19 @@ class VirtualTrader:
         fee = revenue * self.trade_fee
         profit = (price - avg_price) * sell_shares
 
-        self.balance += (revenue - fee)
+        with self._portfolio_lock:
+            self.balance += (revenue - fee)
 
-        # Обновляем портфель
-        if sell_shares >= total_shares:
-            del self.portfolio[ticker]
-            # Очищаем данные трейлинга и уровней
-            self.highest_price.pop(ticker, None)
-        else:
-            self.portfolio[ticker]['shares'] -= sell_shares
+            # Обновляем портфель
+            if sell_shares >= total_shares:
+                self._remove_position(ticker)
+                # Очищаем данные трейлинга и уровней
+                self.highest_price.pop(ticker, None)
+            else:
+                self._shares[i] -= sell_shares
 
         trade = {
-            'timestamp': datetime.now(),
+            'ts': time.time(),
             'ticker': ticker,
             'action': 'SELL',
             'shares': sell_shares,
@@ -416,10 +706,10 @@ class VirtualTrader:
             'reason': reason,
         }
         self.trades.append(trade)
+        self._record_trade(trade)
 
-        db = services.db()
-        if db:
-            db.save_trade(trade)
+        if self.db:
+            self.db.save_trade(trade)
 
         logger.info(f"{'🟢' if profit>0 else '🔴'} SELL {sell_shares} {ticker} @ {price:.2f} = {revenue:,.0f} ₽ (profit: {profit:+,.0f}) reason: {reason}")
 
@@ -431,179 +721,367 @@ class VirtualTrader:
         - цена ниже MA20 → продажа всей позиции
         Также оставляем трейлинг-стоп и обычный стоп-лосс.
         """
-        for ticker, position in list(self.portfolio.items()):
-            if ticker not in current_prices:
+        tickers = self._tickers
+        if not tickers:
+            return
+        # Доходность и стоп-лоссы всех позиций за один проход (средняя цена при продажах не меняется)
+        cur = np.fromiter((current_prices.get(t, np.nan) for t in tickers),
+                          dtype=np.float64, count=len(tickers))
+        scan = _scan_positions if NUMBA_AVAILABLE else _scan_positions_vectorized
+        profit_pcts, stop_flags = scan(self._avg_price, cur, self.stop_loss_pct)
+
+        # Последние MA5/MA20/RSI; NaN — нет цены или истории, такую позицию не трогаем.
+        # Берём их из кэша историй, пока он свежий; историю запрашиваем только для позиций,
+        # у которых кэша нет или он устарел. Без индикаторов позиция не проверяется вовсе
+        # (в том числе на стоп-лосс), поэтому сузить запросы по одним ценовым флагам нельзя
+        indicators = np.full((len(tickers), 3), np.nan)
+        for i, ticker in enumerate(tickers):
+            if np.isnan(cur[i]):
                 continue
+            last = self._cached_indicators(ticker)
+            if last is None:
+                df = self._get_history_df(ticker)
+                if df is None or df.empty:
+                    continue
+                last = (df['MA5'].iat[-1], df['MA20'].iat[-1], df['RSI'].iat[-1])
+            indicators[i] = last
+        ma5, ma20, rsi = indicators.T
+        valid = ~np.isnan(indicators).any(axis=1)
+
+        # Максимум цены для трейлинг-стопа обновляем сразу для всех позиций
+        trailing = np.zeros(len(tickers), dtype=bool)
+        if self.use_trailing_stop:
+            highest = np.fromiter((self.highest_price.get(t, np.nan) for t in tickers),
+                                  dtype=np.float64, count=len(tickers))
+            highest = np.where(valid, np.fmax(highest, cur), highest)
+            for i in np.flatnonzero(valid).tolist():
+                self.highest_price[tickers[i]] = float(highest[i])
+            trailing = valid & (cur <= highest * (1 - self.trailing_stop_pct / 100))
+
+        triggered = valid & (
+            (self.sell_ma20_break & (cur < ma20))
+            | (self.sell_ma5_break & (cur < ma5))
+            | (rsi > self.sell_rsi_overbought)
+            | trailing
+            | stop_flags
+        )
+        # Обычный цикл: ни одна позиция не вышла за пороги
+        if not triggered.any():
+            return
 
+        # Полные закрытия откладываем до конца прохода: до них индексы позиций не сдвигаются
+        to_close = []
+        for i in np.flatnonzero(triggered).tolist():
+            ticker = tickers[i]
+            shares = int(self._shares[i])
             current_price = current_prices[ticker]
-            avg_price = position['avg_price']
-            shares = position['shares']
-
-            # Получаем технические индикаторы
-            df = self._get_history_df(ticker)
-            if df is None or df.empty:
-                continue
-
-            last = df.iloc[-1]
-            ma5 = last.get('MA5')
-            ma20 = last.get('MA20')
-            rsi = last.get('RSI')
-
-            if pd.isna(ma5) or pd.isna(ma20) or pd.isna(rsi):
-                continue
 
             # --- 1. Технические сигналы на продажу ---
             # Приоритет: MA20 (полная продажа) -> MA5 -> RSI
 
             # Пробой MA20 (ниже)
-            if self.sell_ma20_break and current_price < ma20:
-                logger.info(f"📉 {ticker}: пробой MA20 ({ma20:.2f}), продажа всей позиции")
-                self._sell(ticker, current_price, 1.0, reason='ma20_break', sell_all=True)
+            if self.sell_ma20_break and current_price < ma20[i]:
+                logger.info(f"📉 {ticker}: пробой MA20 ({ma20[i]:.2f}), продажа всей позиции")
+                to_close.append((ticker, current_price, 'ma20_break'))
                 continue  # позиция закрыта, дальше не проверяем
 
             # Пробой MA5 (ниже)
-            if self.sell_ma5_break and current_price < ma5:
+            if self.sell_ma5_break and current_price < ma5[i]:
                 shares_to_sell = int(shares * self.sell_ma5_fraction)
                 if shares_to_sell > 0:
-                    logger.info(f"📉 {ticker}: пробой MA5 ({ma5:.2f}), продажа {shares_to_sell} шт. ({self.sell_ma5_fraction*100:.0f}%)")
+                    logger.info(f"📉 {ticker}: пробой MA5 ({ma5[i]:.2f}), продажа {shares_to_sell} шт. ({self.sell_ma5_fraction*100:.0f}%)")
                     self._sell(ticker, current_price, 0.8, reason='ma5_break', shares=shares_to_sell)
                 # после частичной продажи позиция ещё остаётся, проверяем дальше (но RSI уже не проверяем, если не хотим)
 
             # Перекупленность RSI
-            if rsi > self.sell_rsi_overbought:
+            if rsi[i] > self.sell_rsi_overbought:
                 shares_to_sell = int(shares * self.sell_rsi_fraction)
                 if shares_to_sell > 0:
-                    logger.info(f"📈 {ticker}: RSI={rsi:.1f} > {self.sell_rsi_overbought}, продажа {shares_to_sell} шт. ({self.sell_rsi_fraction*100:.0f}%)")
+                    logger.info(f"📈 {ticker}: RSI={rsi[i]:.1f} > {self.sell_rsi_overbought}, продажа {shares_to_sell} шт. ({self.sell_rsi_fraction*100:.0f}%)")
                     self._sell(ticker, current_price, 0.7, reason='rsi_overbought', shares=shares_to_sell)
 
             # --- 2. Трейлинг-стоп (оставляем как есть) ---
-            if self.use_trailing_stop:
-                if ticker not in self.highest_price:
-                    self.highest_price[ticker] = current_price
-                else:
-                    self.highest_price[ticker] = max(self.highest_price[ticker], current_price)
-
-                trailing_stop_level = self.highest_price[ticker] * (1 - self.trailing_stop_pct / 100)
-                if current_price <= trailing_stop_level:
-                    logger.info(f"📉 Трейлинг-стоп для {ticker} при {current_price:.2f} (макс {self.highest_price[ticker]:.2f})")
-                    self._sell(ticker, current_price, 1.0, reason='trailing_stop', sell_all=True)
-                    continue
+            if trailing[i]:
+                logger.info(f"📉 Трейлинг-стоп для {ticker} при {current_price:.2f} (макс {highest[i]:.2f})")
+                to_close.append((ticker, current_price, 'trailing_stop'))
+                continue
 
             # --- 3. Обычный стоп-лосс (оставляем) ---
-            profit_pct = (current_price - avg_price) / avg_price * 100
-            if profit_pct < -5:
-                logger.info(f"🛑 Стоп-лосс для {ticker}: {profit_pct:.1f}%")
-                self._sell(ticker, current_price, 1.0, reason='stop_loss', sell_all=True)
-
-    def _get_current_prices(self) -> Dict[str, float]:
-        """Получает текущие цены всех активов в портфеле"""
-        prices = {}
-        all_tickers = set(self.portfolio.keys()) | {'SBER', 'GAZP', 'YDEX', 'VTBR', 'TATN', 'LKOH'}
-        
-        for ticker in all_tickers:
-            try:
-                price_info = self.stock_provider.get_price(ticker)
-                if price_info and price_info.get('last_price'):
-                    prices[ticker] = price_info['last_price']
-            except:
-                continue
+            if stop_flags[i]:
+                logger.info(f"🛑 Стоп-лосс для {ticker}: {profit_pcts[i]:.1f}%")
+                to_close.append((ticker, current_price, 'stop_loss'))
+
+        for ticker, price, reason in to_close:
+            self._sell(ticker, price, 1.0, reason=reason, sell_all=True)
+
+    def _get_current_prices(self, max_age_seconds: float = PRICE_SNAPSHOT_TTL) -> Dict[str, float]:
+        """Получает текущие цены всех активов в портфеле (снимок моложе max_age_seconds берётся из кэша)"""
+        all_tickers = self.DEFAULT_TICKERS.union(self._tickers)
+        if (time.monotonic() - self._price_cache_ts < max_age_seconds
+                and all_tickers <= self._price_cache_tickers):
+            return self._price_cache
         
+        # Синхронный путь для рабочих потоков; из цикла событий — через asyncio.to_thread
+        prices = asyncio.run(self._get_current_prices_async(all_tickers))
+        self._remember_prices(prices, all_tickers)
         return prices
+
+    def _remember_prices(self, prices: Dict[str, float], tickers):
+        """Кладёт свежий снимок цен в кэш"""
+        self._price_cache = prices
+        self._price_cache_ts = time.monotonic()
+        self._price_cache_tickers = frozenset(tickers)
     
-    def get_portfolio_value(self) -> float:
+    async def _get_current_prices_async(self, tickers) -> Dict[str, float]:
+        """Запрашивает цены тикеров: известные FIGI — одним пакетным запросом, остальные параллельно через один пул"""
+        sem = asyncio.Semaphore(self.PRICE_CONCURRENCY)
+        limits = httpx.Limits(max_keepalive_connections=32, max_connections=32)
+        tickers = list(tickers)
+
+        async with httpx.AsyncClient(limits=limits, timeout=5.0) as client:
+            try:
+                prices = await self.stock_provider.get_prices_async(tickers, client)
+            except Exception:
+                prices = {}
+            missing = [t for t in tickers if t not in prices]
+
+            async def fetch(ticker: str) -> Optional[float]:
+                async with sem:
+                    try:
+                        price_info = await self.stock_provider.get_price_async(ticker, client)
+                    except Exception:
+                        return None
+                return price_info.get('last_price') if price_info else None
+
+            results = await asyncio.gather(*[fetch(t) for t in missing])
+
+        prices.update((ticker, price) for ticker, price in zip(missing, results) if price)
+        return prices
+
+    def get_portfolio_value(self, prices: Optional[Dict[str, float]] = None) -> float:
         """Рассчитывает текущую стоимость портфеля"""
-        total = self.balance
-        prices = self._get_current_prices()
+        if prices is None:
+            prices = self._get_current_prices()
+        tickers, all_shares, _, total = self._positions_snapshot()
         
-        for ticker, position in self.portfolio.items():
-            if ticker in prices:
-                total += position['shares'] * prices[ticker]
+        cur = np.fromiter((prices.get(t, 0.0) for t in tickers), dtype=np.float64, count=len(tickers))
+        total += float(np.dot(all_shares, cur))
         
         return total
     
-    def get_portfolio_summary(self) -> Dict:
+    def get_portfolio_summary(self, prices: Optional[Dict[str, float]] = None) -> Dict:
         """Возвращает сводку по портфелю"""
-        prices = self._get_current_prices()
-        total_value = self.balance
-        positions = []
+        if prices is None:
+            prices = self._get_current_prices()
+        all_tickers, all_shares, all_avg, balance = self._positions_snapshot()
+        # Цены всех позиций одним проходом; позиции без цены (NaN) в сводку не попадают
+        all_cur = np.fromiter((prices.get(t, np.nan) for t in all_tickers), dtype=np.float64, count=len(all_tickers))
+        has_price = ~np.isnan(all_cur)
+        tickers = [all_tickers[i] for i in np.flatnonzero(has_price).tolist()]
+        count = len(tickers)
         
-        for ticker, position in self.portfolio.items():
-            if ticker in prices:
-                current_price = prices[ticker]
-                current_value = position['shares'] * current_price
-                invested = position['shares'] * position['avg_price']
-                profit = current_value - invested
-                profit_percent = (profit / invested) * 100 if invested else 0
-                
-                total_value += current_value
-                
-                positions.append({
-                    'ticker': ticker,
-                    'shares': position['shares'],
-                    'avg_price': position['avg_price'],
-                    'current_price': current_price,
-                    'current_value': current_value,
-                    'profit': profit,
-                    'profit_percent': profit_percent
-                })
+        # Все позиции считаем одним векторным проходом
+        shares = all_shares[has_price]
+        avg = all_avg[has_price]
+        cur = all_cur[has_price]
+        current_value = shares * cur
+        invested = shares * avg
+        profit = current_value - invested
+        profit_percent = np.divide(profit * 100, invested, out=np.zeros(count), where=invested != 0)
+        
+        total_value = balance + float(current_value.sum())
         
-        # Сортируем по размеру позиции
-        positions.sort(key=lambda x: x['current_value'], reverse=True)
+        # Сортируем по размеру позиции (устойчиво, как list.sort)
+        order = np.argsort(-current_value, kind='stable')
+        positions = [
+            {
+                'ticker': tickers[i],
+                'shares': sh,
+                'avg_price': ap,
+                'current_price': prices[tickers[i]],
+                'current_value': cv,
+                'profit': pr,
+                'profit_percent': pp
+            }
+            for i, sh, ap, cv, pr, pp in zip(order.tolist(), shares[order].tolist(), avg[order].tolist(),
+                                             current_value[order].tolist(), profit[order].tolist(),
+                                             profit_percent[order].tolist())
+        ]
         
         total_profit = total_value - self.initial_balance
         total_profit_percent = (total_profit / self.initial_balance) * 100
         
         return {
-            'balance': self.balance,
+            'balance': balance,
             'total_value': total_value,
-            'invested': total_value - self.balance,
+            'invested': total_value - balance,
             'positions': positions,
             'total_profit': total_profit,
             'total_profit_percent': total_profit_percent,
             'position_count': len(positions)
         }
     
-    def _update_performance(self):
+    def _update_performance(self, prices: Optional[Dict[str, float]] = None):
         """Обновляет историю доходности"""
-        summary = self.get_portfolio_summary()
-        summary['timestamp'] = datetime.now()
-        self.performance_history.append(summary)
-        
-        # Оставляем только последние 100 записей
-        if len(self.performance_history) > 100:
-            self.performance_history = self.performance_history[-100:]
+        summary = self.get_portfolio_summary(prices)
+        summary['ts'] = time.time()
+        self.performance_history.append(summary)  # deque сам держит последние MAX_PERFORMANCE_HISTORY
+        self._dirty = True
     
     def _save_state(self):
-        """Сохраняет состояние портфеля"""
-        state = {
-            'balance': self.balance,
-            'portfolio': self.portfolio,
-            'trades': self.trades[-100:],  # Последние 100 сделок
-            'performance_history': self.performance_history[-50:],
-            'last_save': datetime.now().isoformat(),
-            'is_trading': self.is_trading,
-        }
-        
-        os.makedirs('data', exist_ok=True)
-        with open('data/trader_state.json', 'w') as f:
-            json.dump(state, f, indent=2, default=str)
+        """Сохраняет историю доходности и флаги (сделки, позиции и баланс пишутся в БД сразу, см. _record_trade)"""
+        # Вызывается и из обработчиков бота (stop_trading), и из торгового потока: общий .tmp-файл
+        # пишет и подменяет только один поток за раз
+        with self._state_lock:
+            if not self._dirty:
+                return
+            # Флаг сбрасываем до снимка: изменение, сделанное во время записи, попадёт в следующее сохранение
+            self._dirty = False
+            
+            state = {
+                'performance_history': _last(self.performance_history, 50),
+                'last_save': datetime.now(),  # orjson пишет datetime в ISO-формате сам
+                'is_trading': self.is_trading,
+            }
+            
+            # Время хранится числом (ts), так что хватает orjson без default=str; пишем во временный файл и подменяем,
+            # чтобы не оставить битый JSON
+            try:
+                os.makedirs('data', exist_ok=True)
+                tmp_path = self.SNAPSHOT_PATH + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    f.write(orjson.dumps(state, option=orjson.OPT_SERIALIZE_NUMPY))
+                os.replace(tmp_path, self.SNAPSHOT_PATH)
+            except OSError as e:
+                self._dirty = True
+                logger.error(f"Ошибка сохранения состояния трейдера: {e}")
+                return
         
         logger.info("💾 Состояние трейдера сохранено")
     
+    def _open_state_db(self) -> sqlite3.Connection:
+        os.makedirs(os.path.dirname(self.STATE_DB_PATH), exist_ok=True)
+        conn = sqlite3.connect(self.STATE_DB_PATH, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS trades (
+                id INTEGER PRIMARY KEY,
+                ts REAL NOT NULL,
+                ticker TEXT NOT NULL,
+                action TEXT NOT NULL,
+                shares INTEGER NOT NULL,
+                price REAL NOT NULL,
+                amount REAL,
+                fee REAL,
+                profit REAL,
+                confidence REAL,
+                balance_after REAL,
+                reason TEXT
+            )
+        ''')
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_trades_ticker_ts ON trades (ticker, ts)")
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS portfolio (
+                ticker TEXT PRIMARY KEY,
+                shares INTEGER NOT NULL,
+                avg_price REAL NOT NULL
+            )
+        ''')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value REAL NOT NULL
+            )
+        ''')
+        return conn
+    
+    def _record_trade(self, trade: Dict):
+        """Одной транзакцией пишет сделку, новую позицию по тикеру и баланс"""
+        ticker = trade['ticker']
+        i = self._ticker_idx.get(ticker)
+        try:
+            with self._state_lock:
+                conn = self._state_db
+                conn.execute("BEGIN")
+                try:
+                    conn.execute(_INSERT_TRADE_SQL, _trade_row(trade))
+                    if i is None:
+                        conn.execute("DELETE FROM portfolio WHERE ticker = ?", (ticker,))
+                    else:
+                        conn.execute("INSERT OR REPLACE INTO portfolio VALUES (?, ?, ?)",
+                                     (ticker, int(self._shares[i]), float(self._avg_price[i])))
+                    conn.execute("INSERT OR REPLACE INTO meta VALUES ('balance', ?)", (self.balance,))
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+        except Exception as e:
+            logger.error(f"Ошибка записи сделки в БД: {e}")
+    
+    def _migrate_to_db(self, trades: List[Dict]):
+        """Переносит баланс, позиции и сделки из JSON-файлов прежних версий в БД"""
+        with self._state_lock:
+            conn = self._state_db
+            conn.execute("BEGIN")
+            try:
+                conn.executemany(_INSERT_TRADE_SQL, [_trade_row(trade) for trade in trades])
+                conn.executemany("INSERT OR REPLACE INTO portfolio VALUES (?, ?, ?)",
+                                 [(t, p.shares, p.avg_price) for t, p in self.portfolio.items()])
+                conn.execute("INSERT OR REPLACE INTO meta VALUES ('balance', ?)", (self.balance,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        logger.info(f"📦 Состояние трейдера перенесено в {self.STATE_DB_PATH}: {len(trades)} сделок")
+    
     def _load_state(self):
         """Загружает состояние портфеля"""
         try:
-            if os.path.exists('data/trader_state.json'):
-                with open('data/trader_state.json', 'r') as f:
-                    state = json.load(f)
-                
+            state = None
+            legacy = False
+            if os.path.exists(self.SNAPSHOT_PATH):
+                with open(self.SNAPSHOT_PATH, 'rb') as f:
+                    state = orjson.loads(f.read())
+            elif os.path.exists(self.LEGACY_STATE_PATH):
+                # Старый формат: один файл вместе со сделками
+                with open(self.LEGACY_STATE_PATH, 'rb') as f:
+                    state = orjson.loads(f.read())
+                legacy = True
+            
+            if state is not None:
+                self.performance_history = deque(state.get('performance_history', []), maxlen=self.MAX_PERFORMANCE_HISTORY)
+                self.is_trading = state.get('is_trading', False)
+            
+            with self._state_lock:
+                row = self._state_db.execute("SELECT value FROM meta WHERE key = 'balance'").fetchone()
+                if row is not None:
+                    positions = self._state_db.execute("SELECT ticker, shares, avg_price FROM portfolio").fetchall()
+                    recent = self._state_db.execute(
+                        f"SELECT {_TRADE_COLUMNS} FROM trades ORDER BY id DESC LIMIT ?", (self.TRADES_TAIL,)
+                    ).fetchall()
+            
+            if row is not None:
+                self.balance = row[0]
+                self.portfolio = {t: Position(sh, ap) for t, sh, ap in positions}
+                self.trades = deque((_trade_from_row(r) for r in reversed(recent)), maxlen=self.MAX_TRADES)
+            elif state is not None:
+                # Первый запуск с БД: баланс, позиции и сделки берём из JSON и переносим
                 self.balance = state.get('balance', self.initial_balance)
                 self.portfolio = state.get('portfolio', {})
-                self.trades = state.get('trades', [])
-                self.performance_history = state.get('performance_history', [])
-                self.is_trading = state.get('is_trading', False)
+                if os.path.exists(self.TRADES_LOG_PATH):
+                    with open(self.TRADES_LOG_PATH, 'rb') as f:
+                        trades = [_with_ts(orjson.loads(line)) for line in f if line.strip()]
+                elif legacy:
+                    trades = [_with_ts(trade) for trade in state.get('trades', [])]
+                else:
+                    trades = []
+                self._migrate_to_db(trades)
+                self.trades = deque(trades[-self.TRADES_TAIL:], maxlen=self.MAX_TRADES)
+            else:
+                return
 
-                logger.info(f"📂 Загружено состояние: баланс {self.balance:,.0f} ₽")
+            logger.info(f"📂 Загружено состояние: баланс {self.balance:,.0f} ₽")
         except Exception as e:
             logger.error(f"Ошибка загрузки состояния: {e}")
     
@@ -611,50 +1089,30 @@ class VirtualTrader:
         """Форматирует сообщение о портфеле для Telegram"""
         summary = self.get_portfolio_summary()
         
-        lines = []
-        lines.append("💰 *ВИРТУАЛЬНЫЙ ПОРТФЕЛЬ*\n")
-        lines.append(f"💵 Баланс: {summary['balance']:,.0f} ₽")
-        lines.append(f"📊 Инвестировано: {summary['invested']:,.0f} ₽")
-        lines.append(f"🏦 Всего: {summary['total_value']:,.0f} ₽\n")
-        
         # Общая доходность
-        if summary['total_profit'] >= 0:
-            profit_emoji = "🟢"
-        else:
-            profit_emoji = "🔴"
-        
-        lines.append(f"{profit_emoji} *Общая доходность:* {summary['total_profit']:+,.0f} ₽ ({summary['total_profit_percent']:+.1f}%)\n")
+        profit_emoji = "🟢" if summary['total_profit'] >= 0 else "🔴"
+        lines = [_PORTFOLIO_HEADER.format(profit_emoji=profit_emoji, **summary)]
         
         if summary['positions']:
             lines.append("*Текущие позиции:*")
-            for pos in summary['positions'][:10]:
-                if pos['profit'] >= 0:
-                    pos_emoji = "🟢"
-                else:
-                    pos_emoji = "🔴"
-                
-                lines.append(
-                    f"{pos_emoji} *{pos['ticker']}*: {pos['shares']} шт × {pos['current_price']:.2f} = {pos['current_value']:,.0f} ₽\n"
-                    f"   Средняя: {pos['avg_price']:.2f} | {pos_emoji} {pos['profit']:+,.0f} ({pos['profit_percent']:+.1f}%)"
-                )
+            lines.extend(
+                _POSITION_LINE.format(emoji="🟢" if pos['profit'] >= 0 else "🔴", **pos)
+                for pos in summary['positions'][:10]
+            )
         else:
             lines.append("📭 Нет открытых позиций")
         
         # Последние сделки
         if self.trades:
             lines.append("\n*Последние сделки:*")
-            for trade in self.trades[-3:]:
-                if isinstance(trade['timestamp'], str):
-                    date = datetime.fromisoformat(trade['timestamp']).strftime('%d.%m.%y %H:%M')
-                else:
-                    date = trade['timestamp'].strftime('%d.%m.%y %H:%M')
-                    
+            for trade in _last(self.trades, 3):
                 if trade['action'] == 'BUY':
-                    lines.append(f"🟢 {date} BUY {trade['shares']} {trade['ticker']} @ {trade['price']:.2f}")
+                    lines.append(_BUY_LINE.format(date=_fmt_ts(trade['ts']), **trade))
                 else:
                     profit = trade.get('profit', 0)
-                    emoji = "🟢" if profit > 0 else "🔴"
-                    lines.append(f"{emoji} {date} SELL {trade['shares']} {trade['ticker']} @ {trade['price']:.2f} ({profit:+,.0f})")
+                    lines.append(_SELL_LINE.format(emoji="🟢" if profit > 0 else "🔴", date=_fmt_ts(trade['ts']),
+                                                   shares=trade['shares'], ticker=trade['ticker'],
+                                                   price=trade['price'], profit=profit))
         
         return "\n".join(lines)
 
@@ -663,19 +1121,18 @@ class VirtualTrader:
 def start_auto_trading(trader: VirtualTrader, interval_minutes: int = 60):
     """Запускает автоматическую торговлю с заданным интервалом"""
     
-    trader.start_trading()
+    trader.start_trading(analyze_now=False)  # первый цикл ниже начинается сразу
     
     while trader.is_trading:
         try:
             trader.analyze_and_trade()
             trader._save_state()
             
-            # Ждём до следующего анализа
-            for _ in range(interval_minutes * 60):
-                if not trader.is_trading:
-                    break
-                time.sleep(1)
+            # Ждём до следующего анализа; stop_trading() прерывает ожидание сразу
+            if trader._stop_event.wait(timeout=interval_minutes * 60):
+                break
                 
         except Exception as e:
             logger.error(f"Ошибка в торговом цикле: {e}")
-            time.sleep(60)
\ No newline at end of file
+            if trader._stop_event.wait(timeout=60):
+                break
\ No newline at end of file
@@ -1,11 +1,105 @@
-import pandas as pd
 import numpy as np
 from typing import List, Dict, Optional
 from datetime import datetime
 import logging
 
+from jit_utils import njit, prange, NUMBA_AVAILABLE
+
 logger = logging.getLogger(__name__)
 
+# Коды действий в массиве сделок ядра
+_BUY, _SELL, _CLOSE = 1, -1, 0
+_ACTION_NAMES = {_BUY: 'BUY', _SELL: 'SELL', _CLOSE: 'SELL (close)'}
+
+
+@njit(cache=True)
+def _run_kernel(close, signal, initial_capital, commission):
+    """
+    Пробег стратегии по барам: капитал и позиция зависят от пути, поэтому это скалярный цикл.
+    Возвращает кривую капитала, сделки массивами (бар, действие, кол-во, сумма) и итоговый капитал.
+    """
+    n = len(close)
+    equity = np.empty(n)
+    trade_idx = np.empty(n + 1, dtype=np.int64)
+    trade_action = np.empty(n + 1, dtype=np.int8)
+    trade_shares = np.empty(n + 1, dtype=np.int64)
+    trade_amount = np.empty(n + 1)
+
+    capital = initial_capital
+    position = 0
+    k = 0
+    for i in range(n):
+        price = close[i]
+
+        if signal[i] == 1 and capital > 0 and price > 0:
+            shares = int(capital * 0.95 // price)
+            cost = shares * price * (1 + commission)
+            if cost <= capital:
+                position += shares
+                capital -= cost
+                trade_idx[k] = i
+                trade_action[k] = 1
+                trade_shares[k] = shares
+                trade_amount[k] = cost
+                k += 1
+
+        elif signal[i] == -1 and position > 0:
+            revenue = position * price * (1 - commission)
+            capital += revenue
+            trade_idx[k] = i
+            trade_action[k] = -1
+            trade_shares[k] = position
+            trade_amount[k] = revenue
+            k += 1
+            position = 0
+
+        equity[i] = capital + position * price
+
+    # Закрываем оставшуюся позицию по последней цене
+    if position > 0:
+        revenue = position * close[n - 1] * (1 - commission)
+        capital += revenue
+        trade_idx[k] = n - 1
+        trade_action[k] = 0
+        trade_shares[k] = position
+        trade_amount[k] = revenue
+        k += 1
+
+    return equity, trade_idx[:k], trade_action[:k], trade_shares[:k], trade_amount[:k], capital
+
+
+@njit(cache=True, parallel=True, nogil=True)
+def _run_batch_kernel(close, signals, initial_capital, commission):
+    """
+    Тот же пробег для K стратегий сразу (signals — матрица K×N, строка на стратегию); стратегии независимы
+    и идут параллельно по ядрам. Возвращает кривые капитала K×N, итоговые капиталы и число сделок.
+    """
+    k_count, n = signals.shape
+    equity = np.empty((k_count, n))
+    final = np.empty(k_count)
+    trade_count = np.empty(k_count, dtype=np.int64)
+    for k in prange(k_count):
+        eq, idx, _, _, _, capital = _run_kernel(close, signals[k], initial_capital, commission)
+        equity[k] = eq
+        final[k] = capital
+        trade_count[k] = idx.shape[0]
+    return equity, final, trade_count
+
+
+def _equity_metrics(equity: np.ndarray):
+    """Максимальная просадка в % и годовой коэффициент Шарпа по кривой капитала"""
+    peak = np.maximum.accumulate(equity)
+    max_drawdown = float(((equity - peak) / peak * 100).min())
+
+    returns = np.diff(equity) / equity[:-1]
+    if len(returns) > 1:
+        std = returns.std(ddof=1)  # как у pandas
+        sharpe = float(np.sqrt(252) * returns.mean() / std) if std != 0 else 0
+    else:
+        sharpe = float('nan')
+    return max_drawdown, sharpe
+
+
 class Backtester:
     def __init__(self, initial_capital: float = 100000, commission: float = 0.003):
         self.initial_capital = initial_capital
@@ -16,68 +110,39 @@ class Backtester:
         prices: список баров с ключами 'time', 'close'
         signals: список сигналов (1 = купить, -1 = продать, 0 = держать)
         """
-        df = pd.DataFrame(prices)
-        df['signal'] = signals[:len(df)]
-
-        capital = self.initial_capital
-        position = 0
-        trades = []
-        equity_curve = []
-
-        for i, row in df.iterrows():
-            price = row['close']
-
-            if row['signal'] == 1 and capital > 0:
-                shares = int(capital * 0.95 / price)
-                cost = shares * price * (1 + self.commission)
-                if cost <= capital:
-                    position += shares
-                    capital -= cost
-                    trades.append({
-                        'date': row['time'],
-                        'action': 'BUY',
-                        'price': price,
-                        'shares': shares,
-                        'cost': cost
-                    })
-
-            elif row['signal'] == -1 and position > 0:
-                revenue = position * price * (1 - self.commission)
-                capital += revenue
-                trades.append({
-                    'date': row['time'],
-                    'action': 'SELL',
-                    'price': price,
-                    'shares': position,
-                    'revenue': revenue
-                })
-                position = 0
-
-            equity = capital + position * price
-            equity_curve.append({'date': row['time'], 'equity': equity})
-
-        if position > 0:
-            price = df.iloc[-1]['close']
-            revenue = position * price * (1 - self.commission)
-            capital += revenue
-            trades.append({
-                'date': df.iloc[-1]['time'],
-                'action': 'SELL (close)',
+        # Из баров нужны только время и цена закрытия: берём их напрямую, без DataFrame из списка словарей
+        n = len(prices)
+        times = [p['time'] for p in prices]
+        close = np.fromiter((p['close'] for p in prices), dtype=np.float64, count=n)
+        signal = np.asarray(signals[:n], dtype=np.int8)
+        # Без numba ядро выполняется как обычный Python: по спискам он идёт быстрее, чем по скалярам NumPy
+        if NUMBA_AVAILABLE:
+            bars = (close, signal)
+        else:
+            bars = (close.tolist(), signal.tolist())
+        equity, trade_idx, trade_action, trade_shares, trade_amount, capital = _run_kernel(
+            *bars, float(self.initial_capital), float(self.commission))
+
+        # Списки сделок и капитала собираем один раз по массивам ядра (в цикле по барам ничего не растёт)
+        close_at = close[trade_idx].tolist()
+        trades = [
+            {
+                'date': times[i],
+                'action': _ACTION_NAMES[action],
                 'price': price,
-                'shares': position,
-                'revenue': revenue
-            })
+                'shares': shares,
+                'cost' if action == _BUY else 'revenue': amount
+            }
+            for i, action, price, shares, amount in zip(trade_idx.tolist(), trade_action.tolist(), close_at,
+                                                         trade_shares.tolist(), trade_amount.tolist())
+        ]
+        equity_curve = [{'date': t, 'equity': e} for t, e in zip(times, equity.tolist())]
 
         final_equity = capital
         total_return = (final_equity - self.initial_capital) / self.initial_capital * 100
 
-        df_equity = pd.DataFrame(equity_curve)
-        df_equity['peak'] = df_equity['equity'].cummax()
-        df_equity['drawdown'] = (df_equity['equity'] - df_equity['peak']) / df_equity['peak'] * 100
-        max_drawdown = df_equity['drawdown'].min()
-
-        returns = df_equity['equity'].pct_change().dropna()
-        sharpe = np.sqrt(252) * returns.mean() / returns.std() if returns.std() != 0 else 0
+        # Просадка и коэффициент Шарпа прямо по массиву капитала, без промежуточного DataFrame
+        max_drawdown, sharpe = _equity_metrics(equity)
 
         return {
             'ticker': ticker,
@@ -88,4 +153,28 @@ class Backtester:
             'sharpe_ratio': sharpe,
             'trades': trades,
             'equity_curve': equity_curve
-        }
\ No newline at end of file
+        }
+
+    def run_batch(self, ticker: str, prices: List[Dict], signals_matrix) -> Dict[int, Dict]:
+        """
+        Перебор параметров: один ряд цен и K наборов сигналов (матрица N×K, столбец на стратегию).
+        Возвращает {номер столбца: сводка} без списков сделок и кривых капитала.
+        """
+        close = np.fromiter((p['close'] for p in prices), dtype=np.float64, count=len(prices))
+        signals = np.ascontiguousarray(np.asarray(signals_matrix, dtype=np.int8)[:len(close)].T)
+
+        equity, final, trade_count = _run_batch_kernel(
+            close, signals, float(self.initial_capital), float(self.commission))
+
+        results = {}
+        for k in range(signals.shape[0]):
+            max_drawdown, sharpe = _equity_metrics(equity[k])
+            results[k] = {
+                'ticker': ticker,
+                'final_equity': float(final[k]),
+                'total_return': (final[k] - self.initial_capital) / self.initial_capital * 100,
+                'max_drawdown': max_drawdown,
+                'sharpe_ratio': sharpe,
+                'trades_count': int(trade_count[k]),
+            }
+        return results
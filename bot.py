@@ -2,58 +2,116 @@
 Модуль с обработчиками команд Telegram.
 Все объекты извлекаются из context.bot_data.
 """
+import asyncio
 import os
 from telegram import Update
 from telegram.ext import ContextTypes
 import logging
+from collections import OrderedDict
 from datetime import datetime, time, timedelta
-import pandas as pd
 import numpy as np
 from backtester import Backtester
+from jit_utils import njit
+from indicators import sma, crossover_signals
 import services
 # import ollama
 import json
 import sqlite3
 import httpx
-from config import OLLAMA_HOST
+from config import OLLAMA_HOST, OLLAMA_MODEL
 
 logger = logging.getLogger(__name__)
 
+_SERVICE_NAMES = ('db', 'stock_provider', 'news_parser', 'ai_advisor')
+
+def _ensure_services(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Возвращает кортеж (db, stock_provider, news_parser, ai_advisor).
+    Объекты берутся из реестра services один раз и кешируются в bot_data,
+    дальше обработчик обходится одним поиском по словарю.
+    Если сервис создать не удалось, на его месте None (повторим при следующем вызове).
+    """
+    cached = context.bot_data.get('services')
+    if cached is not None:
+        return cached
+
+    result = []
+    for name in _SERVICE_NAMES:
+        try:
+            result.append(getattr(services, name)())
+        except Exception as e:
+            logger.error(f"❌ Не удалось создать {name}: {e}")
+            result.append(None)
+    result = tuple(result)
+
+    context.bot_data.update((k, v) for k, v in zip(_SERVICE_NAMES, result) if v is not None)
+    if None not in result:
+        context.bot_data['services'] = result
+    return result
+
+# Кеши ИИ-ответов: фото по file_unique_id, тикер по (тикер, дата, час); LRU на OrderedDict
+MAX_ANALYSIS_CACHE = 64
+_IMAGE_ANALYSIS: "OrderedDict[str, str]" = OrderedDict()
+_TICKER_ANALYSIS: "OrderedDict[tuple, str]" = OrderedDict()
+
+def _cache_get(cache: OrderedDict, key):
+    value = cache.get(key)
+    if value is not None:
+        cache.move_to_end(key)
+    return value
+
+def _cache_put(cache: OrderedDict, key, value) -> None:
+    cache[key] = value
+    cache.move_to_end(key)
+    if len(cache) > MAX_ANALYSIS_CACHE:
+        cache.popitem(last=False)
+
+def _http_client(context: ContextTypes.DEFAULT_TYPE) -> httpx.AsyncClient:
+    """Общий httpx.AsyncClient из bot_data: пул соединений с Ollama живёт между запросами."""
+    client = context.bot_data.get('httpx')
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(timeout=30)
+        context.bot_data['httpx'] = client
+    return client
+
+# Текст /start и /help: статичен, собирается один раз при импорте
+_START_TEXT = (
+    "📰 Бот для отслеживания финансовых новостей и цен акций\n\n"
+    "Я помогу тебе следить за новостями компаний и отслеживать цены акций.\n\n"
+    "ИИ-трейдер (автозапуск):\n"
+    "/traderstart - Запустить трейдера\n"
+    "/traderstatus - 📊 Состояние портфеля\n"
+    "/traderanalyze - 🔍 Принудительный анализ\n"
+    "/traderstop - ⏹️ Остановить трейдера\n"
+    "/profit - 📈 Фиксируем прибыль📈\n"
+    "/trades – 📋 история сделок\n\n"
+    "Новости:\n"
+    "/news - последние новости\n"
+    "/subscribe SBER - подписаться на новости\n"
+    "/search SBER - поиск новостей\n"
+    "/pulse – 📱 Посты из Tinkoff Пульс\n\n"
+    "Цены акций:\n"
+    "/price SBER - цена акции\n"
+    "/portfolio - цены по подпискам\n"
+    "/tickers - список доступных тикеров\n\n"
+    "Аналитика:\n"
+    "/advice - 🤖 ИИ-рекомендации\n"
+    "/backtest TICKER дней - 📊 бэктест стратегии\n"
+    "/chart TICKER [дней] [rsi] [macd] – 📈 график с анализом\n"
+    "/analyze_ticker TICKER – 🧠 глубокий анализ акции\n"
+    "/ratings – 📊 рейтинг компаний по новостям\n\n"
+    "Управление:\n"
+    "/mysubs - мои подписки\n"
+    "/status - статус бота\n"
+    "/help - подробная помощь"
+)
+
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await _log_user_activity(update)
     """Приветственное сообщение."""
     if not update.effective_chat:
         return
-    text = (
-        "📰 Бот для отслеживания финансовых новостей и цен акций\n\n"
-        "Я помогу тебе следить за новостями компаний и отслеживать цены акций.\n\n"
-        "ИИ-трейдер (автозапуск):\n"
-        "/traderstart - Запустить трейдера\n"
-        "/traderstatus - 📊 Состояние портфеля\n"
-        "/traderanalyze - 🔍 Принудительный анализ\n"
-        "/traderstop - ⏹️ Остановить трейдера\n"
-        "/profit - 📈 Фиксируем прибыль📈\n"
-        "/trades – 📋 история сделок\n\n"
-        "Новости:\n"
-        "/news - последние новости\n"
-        "/subscribe SBER - подписаться на новости\n"
-        "/search SBER - поиск новостей\n"
-        "/pulse – 📱 Посты из Tinkoff Пульс\n\n"
-        "Цены акций:\n"
-        "/price SBER - цена акции\n"
-        "/portfolio - цены по подпискам\n"
-        "/tickers - список доступных тикеров\n\n"
-        "Аналитика:\n"
-        "/advice - 🤖 ИИ-рекомендации\n"
-        "/backtest TICKER дней - 📊 бэктест стратегии\n"
-        "/chart TICKER [дней] [rsi] [macd] – 📈 график с анализом\n"
-        "/analyze_ticker TICKER – 🧠 глубокий анализ акции\n"
-        "/ratings – 📊 рейтинг компаний по новостям\n\n"
-        "Управление:\n"
-        "/mysubs - мои подписки\n"
-        "/status - статус бота\n"
-        "/help - подробная помощь"
-    )
+    text = _START_TEXT
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text=text
@@ -130,12 +188,47 @@ async def trades_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         lines.append(f"{action_emoji} {date_str} {ticker} {action} {shares} @ {price:.2f} {profit_str} {reason_emoji}")
     await context.bot.send_message(chat_id=update.effective_chat.id, text="\n".join(lines), parse_mode='Markdown')
 
+@njit(cache=True)
+def _technical_summary(closes):
+    """
+    MA5 (последние 5 закрытий), MA20 (среднее всего окна) и RSI по средним приросту/падению за 14 баров.
+    Один проход по массиву вместо DataFrame с diff/where/rolling ради последнего значения.
+    """
+    n = closes.shape[0]
+    ma5 = closes[n - 5:].mean()
+    ma20 = closes.mean()
+
+    gain = 0.0
+    loss = 0.0
+    for i in range(n - 14, n):
+        d = closes[i] - closes[i - 1]
+        if d > 0:
+            gain += d
+        else:
+            loss -= d
+    gain /= 14
+    loss /= 14
+
+    rsi = 50.0
+    if loss != 0:
+        rsi = 100 - (100 / (1 + gain / loss))
+    return ma5, ma20, rsi
+
+# Таблица экранирования для str.translate: все спецсимволы заменяются за один проход
+_MD_TABLE = str.maketrans({c: '\\' + c for c in '_*[]()~`>#+-=|{}.!'})
+
+# Значки источников для /news: словарь строится один раз при импорте, а не на каждую новость
+_SOURCE_EMOJI = {
+    'interfax': '📰', 'tass': '🇷🇺', 'prime': '💼', 'cbr': '🏦',
+    'bloomberg': '💰', 'reuters': '📈', 'ft': '📉', 'wsj': '📊',
+    'cnbc': '📺', 'investing': '💹', 'smartlab': '🧠',
+    'kommersant': '📌', 'vedomosti': '🗞️', 'rbc': '🔴',
+}
+_NEWS_RULE = "═" * 40
+
 def escape_markdown(text: str) -> str:
     """Экранирует спецсимволы для Markdown."""
-    special_chars = ['_', '*', '[', ']', '(', ')', '~', '`', '>', '#', '+', '-', '=', '|', '{', '}', '.', '!']
-    for char in special_chars:
-        text = text.replace(char, f'\\{char}')
-    return text
+    return text.translate(_MD_TABLE)
 
 async def _log_user_activity(update: Update) -> None:
     if update.effective_user:
@@ -252,7 +345,9 @@ async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     from chart_generator import plot_candlestick
-    file_path = plot_candlestick(
+    # Рендер matplotlib и ИИ-вызовы уходят в поток, чтобы не блокировать цикл событий
+    chart = await asyncio.to_thread(
+        plot_candlestick,
         history,
         ticker,
         ma_periods=[5, 20],
@@ -260,23 +355,21 @@ async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         show_macd=show_macd
     )
 
-    if not file_path:
+    if not chart:
         await msg.edit_text("❌ Не удалось построить график.")
         return
 
-    with open(file_path, 'rb') as photo:
-        await context.bot.send_photo(
-            chat_id=update.effective_chat.id,
-            photo=photo,
-            caption=f"📊 График {ticker} за {days} дней"
-        )
-    os.unlink(file_path)
+    await context.bot.send_photo(
+        chat_id=update.effective_chat.id,
+        photo=chart,
+        caption=f"📊 График {ticker} за {days} дней"
+    )
     await msg.delete()
 
     # после отправки графика анализируем его
-    # if file_path:
+    # if chart:
     #     advisor = services.ai_advisor()
-    #     analysis = advisor.analyze_image(file_path, f"График {ticker}")
+    #     analysis = advisor.analyze_image(chart, f"График {ticker}")
     #     if analysis:
     #         await context.bot.send_message(
     #             chat_id=update.effective_chat.id,
@@ -285,7 +378,6 @@ async def chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def analyze_chart_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Анализирует график (по фото или тикеру)."""
-    import os
     await _log_user_activity(update)
     if not update.effective_chat:
         return
@@ -298,24 +390,25 @@ async def analyze_chart_command(update: Update, context: ContextTypes.DEFAULT_TY
     # Если пользователь прикрепил фото
     if update.message.photo:
         photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        import tempfile
-        import os
-        with tempfile.NamedTemporaryFile(suffix='.jpg', delete=False) as tmp:
-            await file.download_to_drive(tmp.name)
+        # Повторно присланное фото не скачиваем и не гоняем через модель ещё раз
+        analysis = _cache_get(_IMAGE_ANALYSIS, photo.file_unique_id)
+        if analysis is None:
             advisor = services.ai_advisor()
             if advisor is None:
                 await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Ошибка инициализации ИИ")
                 return
-            analysis = advisor.analyze_image(tmp.name, "Анализ графика по запросу")
-            os.unlink(tmp.name)
+            file = await context.bot.get_file(photo.file_id)
+            image = await file.download_as_bytearray()
+            analysis = await asyncio.to_thread(advisor.analyze_image, image, "Анализ графика по запросу")
             if analysis:
-                await context.bot.send_message(
-                    chat_id=update.effective_chat.id,
-                    text=f"🧠 *AI-анализ графика:*\n{analysis}"
-                )
-            else:
-                await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Не удалось проанализировать изображение")
+                _cache_put(_IMAGE_ANALYSIS, photo.file_unique_id, analysis)
+        if analysis:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text=f"🧠 *AI-анализ графика:*\n{analysis}"
+            )
+        else:
+            await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Не удалось проанализировать изображение")
         return
 
     # Если нет фото, но есть аргумент (тикер)
@@ -330,19 +423,22 @@ async def analyze_chart_command(update: Update, context: ContextTypes.DEFAULT_TY
             await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Нет данных для построения графика")
             return
         from chart_generator import plot_candlestick
-        file_path = plot_candlestick(history, ticker)
-        if not file_path:
+        chart = await asyncio.to_thread(plot_candlestick, history, ticker)
+        if not chart:
             await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Не удалось построить график")
             return
-        with open(file_path, 'rb') as f:
-            await context.bot.send_photo(chat_id=update.effective_chat.id, photo=f, caption=f"📊 График {ticker}")
+        image = chart.getvalue()  # неизменяемая копия для модели, буфер целиком уходит в send_photo
+        photo_task = asyncio.create_task(
+            context.bot.send_photo(chat_id=update.effective_chat.id, photo=chart, caption=f"📊 График {ticker}")
+        )
         advisor = services.ai_advisor()
         if advisor is None:
-            os.unlink(file_path)
+            await photo_task
             await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Ошибка инициализации ИИ")
             return
-        analysis = advisor.analyze_image(file_path, f"График {ticker}")
-        os.unlink(file_path)
+        # График загружается в Telegram, пока модель его анализирует
+        analysis = await asyncio.to_thread(advisor.analyze_image, image, f"График {ticker}")
+        await photo_task
         if analysis:
             await context.bot.send_message(chat_id=update.effective_chat.id, text=f"🧠 *AI-анализ графика:*\n{analysis}")
         else:
@@ -465,6 +561,14 @@ async def analyze_ticker_command(update: Update, context: ContextTypes.DEFAULT_T
         await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Ошибка инициализации ИИ")
         return
 
+    # Ответ модели по тикеру переиспользуется в пределах часа
+    now = datetime.now()
+    cache_key = (ticker, now.date().isoformat(), now.hour)
+    cached = _cache_get(_TICKER_ANALYSIS, cache_key)
+    if cached is not None:
+        await context.bot.send_message(chat_id=update.effective_chat.id, text=cached, parse_mode='Markdown')
+        return
+
     msg = await context.bot.send_message(chat_id=update.effective_chat.id, text=f"🔍 Анализирую {ticker}, подожди...")
 
     # 1. Текущая цена
@@ -486,20 +590,9 @@ async def analyze_ticker_command(update: Update, context: ContextTypes.DEFAULT_T
     history = sp.get_history(ticker, days=30)
     tech_summary = "Недостаточно данных для технического анализа"
     if history and len(history) >= 20:
-        df = pd.DataFrame(history)
-        closes = df['close'].values
-        # Скользящие средние
-        ma5 = df['close'].tail(5).mean()
-        ma20 = df['close'].mean()
+        closes = np.fromiter((h['close'] for h in history), dtype=np.float64, count=len(history))
+        ma5, ma20, rsi = _technical_summary(closes)
         trend = "восходящий" if ma5 > ma20 else "нисходящий" if ma5 < ma20 else "боковой"
-        # RSI
-        delta = df['close'].diff()
-        gain = (delta.where(delta > 0, 0)).rolling(window=14).mean().iloc[-1]
-        loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean().iloc[-1]
-        rsi = 50
-        if loss != 0:
-            rs = gain / loss
-            rsi = 100 - (100 / (1 + rs))
         tech_summary = f"Тренд: {trend}, MA5: {ma5:.2f}, MA20: {ma20:.2f}, RSI: {rsi:.1f}"
 
     # 5. Формируем промпт
@@ -526,63 +619,48 @@ async def analyze_ticker_command(update: Update, context: ContextTypes.DEFAULT_T
     try:        
         url = f"{OLLAMA_HOST}/api/chat"
         payload = {
-            "model": advisor.llm_model,  # используем gemma3:12b
+            "model": advisor.llm_model,  # модель из OLLAMA_MODEL
             "messages": [{"role": "user", "content": prompt}],
             "options": {"temperature": 0.3},
             "stream": False
         }
-        response = httpx.post(url, json=payload, timeout=30)
+        # Асинхронный запрос: ответ модели ждём, не блокируя цикл событий бота
+        response = await _http_client(context).post(url, json=payload)
         if response.status_code == 200:
             data = response.json()
             answer = data['message']['content']
-            await msg.edit_text(f"🧠 *Анализ {ticker}*\n\n{answer}", parse_mode='Markdown')
+            text = f"🧠 *Анализ {ticker}*\n\n{answer}"
+            await msg.edit_text(text, parse_mode='Markdown')
+            _cache_put(_TICKER_ANALYSIS, cache_key, text)
         else:
             await msg.edit_text(f"❌ Ошибка при анализе {ticker} (HTTP {response.status_code})")
     except Exception as e:
         logger.error(f"Ошибка при анализе {ticker}: {e}")
         await msg.edit_text(f"❌ Ошибка при анализе {ticker}")
 
+# Шаблон /status: в обработчике остаётся только подставить значения
+_STATUS_TEMPLATE = (
+    "📊 *СТАТУС БОТА*\n"
+    "═══════════════════════════\n\n"
+    "📰 Источников новостей: {news_sources}\n"
+    "💰 Доступных тикеров: {tickers_count}\n"
+    "📊 Источник цен: Tinkoff API\n"
+    "🤖 Модель ИИ: {model}\n"
+    "✅ Бот работает"
+)
+
 async def status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статус бота."""
     if not update.effective_chat:
         return
 
-    # Получаем или создаём news_parser
-    news_parser = context.bot_data.get('news_parser')
-    if news_parser is None:
-        try:
-            from news_parser import NewsParser
-            news_parser = NewsParser()
-            context.bot_data['news_parser'] = news_parser
-            logger.info("✅ news_parser создан автоматически в status_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать news_parser: {e}")
-
-    # Получаем или создаём stock_provider
-    stock_provider = context.bot_data.get('stock_provider')
-    if stock_provider is None:
-        try:
-            from tinkoff_stocks import TinkoffStockProvider
-            from config import TINKOFF_TOKEN
-            stock_provider = TinkoffStockProvider(TINKOFF_TOKEN)
-            context.bot_data['stock_provider'] = stock_provider
-            logger.info("✅ stock_provider создан автоматически в status_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать stock_provider: {e}")
+    _, stock_provider, news_parser, _ = _ensure_services(context)
 
     # Если после всех попыток чего-то нет – выводим частичную статистику
     news_sources = len(news_parser.rss_sources) if news_parser else "N/A"
     tickers_count = len(stock_provider.priority_figi) if stock_provider else "N/A"
 
-    text = (
-        "📊 *СТАТУС БОТА*\n"
-        "═══════════════════════════\n\n"
-        f"📰 Источников новостей: {news_sources}\n"
-        f"💰 Доступных тикеров: {tickers_count}\n"
-        f"📊 Источник цен: Tinkoff API\n"
-        f"🤖 Модель ИИ: gemma3:12b\n"
-        f"✅ Бот работает"
-    )
+    text = _STATUS_TEMPLATE.format(news_sources=news_sources, tickers_count=tickers_count, model=OLLAMA_MODEL)
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text=text,
@@ -594,34 +672,14 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_chat:
         return
 
-    # Получаем или создаём news_parser
-    news_parser = context.bot_data.get('news_parser')
+    # Если нет базы, просто покажем новости без сохранения
+    db, _, news_parser, _ = _ensure_services(context)
     if news_parser is None:
-        try:
-            from news_parser import NewsParser
-            news_parser = NewsParser()
-            context.bot_data['news_parser'] = news_parser
-            logger.info("✅ news_parser создан автоматически в news_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать news_parser: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка инициализации парсера"
-            )
-            return
-
-    # Получаем или создаём db
-    db = context.bot_data.get('db')
-    if db is None:
-        try:
-            from database import NewsDatabase
-            db = NewsDatabase()
-            context.bot_data['db'] = db
-            logger.info("✅ db создан автоматически в news_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать db: {e}")
-            # Если нет базы, просто покажем новости без сохранения
-            db = None
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка инициализации парсера"
+        )
+        return
 
     loading_msg = await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -630,7 +688,7 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     try:
-        news = news_parser.fetch_all_news(limit_per_source=2, max_total=20)
+        news = await asyncio.to_thread(news_parser.fetch_all_news, limit_per_source=2, max_total=20)
         if not news:
             await loading_msg.edit_text("😕 Не удалось получить новости. Попробуй позже.")
             return
@@ -639,26 +697,19 @@ async def news_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if db:
             saved = db.save_news(news)
 
-        lines = ["📰 *СВЕЖИЕ НОВОСТИ*\n"]
-        lines.append(f"📊 Всего: {len(news)} | Новых: {saved}\n")
-        lines.append("═" * 40)
+        lines = ["📰 *СВЕЖИЕ НОВОСТИ*\n", f"📊 Всего: {len(news)} | Новых: {saved}\n", _NEWS_RULE]
 
         for item in news[:7]:
-            source_emoji = {
-                'interfax': '📰', 'tass': '🇷🇺', 'prime': '💼', 'cbr': '🏦',
-                'bloomberg': '💰', 'reuters': '📈', 'ft': '📉', 'wsj': '📊',
-                'cnbc': '📺', 'investing': '💹', 'smartlab': '🧠',
-                'kommersant': '📌', 'vedomosti': '🗞️', 'rbc': '🔴',
-            }.get(item.source, '📰')
-
+            source_emoji = _SOURCE_EMOJI.get(item.source, '📰')
             safe_title = escape_markdown(item.title)
             tickers = f" `{', '.join(item.related_tickers)}`" if item.related_tickers else ''
-            lines.append(f"\n{source_emoji} *{safe_title}*{tickers}")
-            lines.append(f"   🕒 {format_datetime(item.published)} | 📍 {item.source}")
-            lines.append(f"   🔗 {item.link}")
+            lines.append(
+                f"\n{source_emoji} *{safe_title}*{tickers}\n"
+                f"   🕒 {format_datetime(item.published)} | 📍 {item.source}\n"
+                f"   🔗 {item.link}"
+            )
 
-        lines.append("\n" + "═" * 40)
-        lines.append("💡 Используй /advice для ИИ-анализа")
+        lines.append("\n" + _NEWS_RULE + "\n💡 Используй /advice для ИИ-анализа")
 
         full = "\n".join(lines)
         if len(full) > 4000:
@@ -676,22 +727,13 @@ async def price_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     ticker = context.args[0].upper()
 
-    # Получаем или создаём stock_provider
-    stock_provider = context.bot_data.get('stock_provider')
+    stock_provider = _ensure_services(context)[1]
     if stock_provider is None:
-        try:
-            from tinkoff_stocks import TinkoffStockProvider
-            from config import TINKOFF_TOKEN
-            stock_provider = TinkoffStockProvider(TINKOFF_TOKEN)
-            context.bot_data['stock_provider'] = stock_provider
-            logger.info("✅ stock_provider создан автоматически в price_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать stock_provider: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка инициализации модуля цен"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка инициализации модуля цен"
+        )
+        return
 
     loading = await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -724,22 +766,13 @@ async def advice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if not update.effective_chat:
         return
 
-    # Получаем или создаём AIAdvisor
-    advisor = context.bot_data.get('ai_advisor')
+    advisor = _ensure_services(context)[3]
     if advisor is None:
-        try:
-            from ai_advisor import AIAdvisor
-            from config import TINKOFF_TOKEN
-            advisor = AIAdvisor(TINKOFF_TOKEN)
-            context.bot_data['ai_advisor'] = advisor
-            logger.info("✅ AIAdvisor создан автоматически в advice_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать AIAdvisor: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка инициализации ИИ"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка инициализации ИИ"
+        )
+        return
 
     loading = await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -748,33 +781,52 @@ async def advice_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
 
     try:
-        analysis = advisor.analyze_all()
+        analysis = await asyncio.to_thread(advisor.analyze_all)
         message = advisor.format_advice_message(analysis)
         await loading.edit_text(message, parse_mode='Markdown')
     except Exception as e:
         logger.error(f"Ошибка в advice_command: {e}")
         await loading.edit_text("❌ Ошибка анализа")
 
+_MONITOR_TEXT = (
+    "📡 *Мониторинг рынка*\n\n"
+    "✅ Автоматический мониторинг запущен и работает в фоне.\n"
+    "Он проверяет новости каждый час и присылает уведомления о важных событиях.\n\n"
+    "Используй:\n"
+    "• `/monitor now` — проверить рынок прямо сейчас\n"
+    "• `/advice` — получить рекомендацию от ИИ\n"
+    "• `/trader_status` — состояние портфеля\n"
+    "• `/news` — свежие новости"
+)
+
 async def monitor_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показывает статус мониторинга рынка"""
     if not update.effective_chat:
         return
 
+    # /monitor now — внеочередная проверка рынка, если мониторинг запущен
+    if context.args and context.args[0].lower() == 'now':
+        monitor = services.get_all_services().get('ai_monitor')
+        if monitor is None:
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="⚠️ Мониторинг рынка сейчас не запущен"
+            )
+        else:
+            monitor.trigger_check()
+            await context.bot.send_message(
+                chat_id=update.effective_chat.id,
+                text="🔍 Запускаю внеочередную проверку рынка..."
+            )
+        return
+
     # Проверяем, запущен ли мониторинг (по наличию chat_id в bot_data или по флагу)
     # В текущей реализации мониторинг запускается автоматически в main.py,
     # поэтому просто покажем сообщение о том, что он работает.
 
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
-        text=(
-            "📡 *Мониторинг рынка*\n\n"
-            "✅ Автоматический мониторинг запущен и работает в фоне.\n"
-            "Он проверяет новости каждый час и присылает уведомления о важных событиях.\n\n"
-            "Используй:\n"
-            "• `/advice` — получить рекомендацию от ИИ\n"
-            "• `/trader_status` — состояние портфеля\n"
-            "• `/news` — свежие новости"
-        ),
+        text=_MONITOR_TEXT,
         parse_mode='Markdown'
     )
 
@@ -796,22 +848,13 @@ async def backtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     except:
         days = 30
 
-    # Получаем или создаём stock_provider
-    stock_provider = context.bot_data.get('stock_provider')
+    stock_provider = _ensure_services(context)[1]
     if stock_provider is None:
-        try:
-            from tinkoff_stocks import TinkoffStockProvider
-            from config import TINKOFF_TOKEN
-            stock_provider = TinkoffStockProvider(TINKOFF_TOKEN)
-            context.bot_data['stock_provider'] = stock_provider
-            logger.info("✅ stock_provider создан автоматически в backtest_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать stock_provider: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка инициализации модуля цен"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка инициализации модуля цен"
+        )
+        return
 
     msg = await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -823,22 +866,15 @@ async def backtest_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.edit_text("❌ Не удалось загрузить историю.")
         return
 
-    df = pd.DataFrame(history)
-    if len(df) < 20:
+    if len(history) < 20:
         await msg.edit_text("❌ Недостаточно исторических данных.")
         return
 
-    df['ma_short'] = df['close'].rolling(window=5).mean()
-    df['ma_long'] = df['close'].rolling(window=20).mean()
-    signals = [0] * len(df)
-    for i in range(1, len(df)):
-        if df['ma_short'].iloc[i] > df['ma_long'].iloc[i] and df['ma_short'].iloc[i-1] <= df['ma_long'].iloc[i-1]:
-            signals[i] = 1
-        elif df['ma_short'].iloc[i] < df['ma_long'].iloc[i] and df['ma_short'].iloc[i-1] >= df['ma_long'].iloc[i-1]:
-            signals[i] = -1
+    closes = np.fromiter((h['close'] for h in history), dtype=np.float64, count=len(history))
+    signals = crossover_signals(sma(closes, 5), sma(closes, 20))
 
     bt = Backtester()
-    result = bt.run(ticker, history, signals)
+    result = await asyncio.to_thread(bt.run, ticker, history, signals)
     if not result:
         await msg.edit_text("❌ Ошибка при выполнении бэктеста.")
         return
@@ -872,7 +908,7 @@ async def subscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Не удалось определить пользователя.")
         return
     user_id = update.effective_user.id
-    db = context.bot_data.get('db')
+    db = _ensure_services(context)[0]
     if db is None:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Ошибка базы данных")
         return
@@ -890,7 +926,7 @@ async def unsubscribe_command(update: Update, context: ContextTypes.DEFAULT_TYPE
         return
     user_id = update.effective_user.id
 
-    db = context.bot_data.get('db')
+    db = _ensure_services(context)[0]
     if db is None:
         await context.bot.send_message(chat_id=update.effective_chat.id, text="❌ Ошибка базы данных")
         return
@@ -908,21 +944,13 @@ async def mysubs_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Получаем или создаём db
-    db = context.bot_data.get('db')
+    db = _ensure_services(context)[0]
     if db is None:
-        try:
-            from database import NewsDatabase
-            db = NewsDatabase()
-            context.bot_data['db'] = db
-            logger.info("✅ db создан автоматически в mysubs_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать db: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка базы данных"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка базы данных"
+        )
+        return
 
     user_id = update.effective_user.id
     raw_subs = db.get_user_subscriptions(user_id)
@@ -944,21 +972,13 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
     ticker = context.args[0].upper()
 
-    # Получаем или создаём news_parser
-    news_parser = context.bot_data.get('news_parser')
+    news_parser = _ensure_services(context)[2]
     if news_parser is None:
-        try:
-            from news_parser import NewsParser
-            news_parser = NewsParser()
-            context.bot_data['news_parser'] = news_parser
-            logger.info("✅ news_parser создан автоматически в search_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать news_parser: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка инициализации парсера"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка инициализации парсера"
+        )
+        return
 
     msg = await context.bot.send_message(
         chat_id=update.effective_chat.id,
@@ -1014,38 +1034,21 @@ async def portfolio_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
 
-    # Получаем или создаём db
-    db = context.bot_data.get('db')
+    db = _ensure_services(context)[0]
     if db is None:
-        try:
-            from database import NewsDatabase
-            db = NewsDatabase()
-            context.bot_data['db'] = db
-            logger.info("✅ db создан автоматически в portfolio_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать db: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка базы данных"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка базы данных"
+        )
+        return
 
-    # Получаем или создаём stock_provider
-    stock_provider = context.bot_data.get('stock_provider')
+    stock_provider = _ensure_services(context)[1]
     if stock_provider is None:
-        try:
-            from tinkoff_stocks import TinkoffStockProvider
-            from config import TINKOFF_TOKEN
-            stock_provider = TinkoffStockProvider(TINKOFF_TOKEN)
-            context.bot_data['stock_provider'] = stock_provider
-            logger.info("✅ stock_provider создан автоматически в portfolio_command")
-        except Exception as e:
-            logger.error(f"❌ Не удалось создать stock_provider: {e}")
-            await context.bot.send_message(
-                chat_id=update.effective_chat.id,
-                text="❌ Ошибка инициализации модуля цен"
-            )
-            return
+        await context.bot.send_message(
+            chat_id=update.effective_chat.id,
+            text="❌ Ошибка инициализации модуля цен"
+        )
+        return
 
     user_id = update.effective_user.id
     raw_subs = db.get_user_subscriptions(user_id)
@@ -1102,7 +1105,8 @@ async def trader_start_command(update: Update, context: ContextTypes.DEFAULT_TYP
             parse_mode='Markdown'
         )
     else:
-        trader.start_trading()
+        # Немедленный торговый цикл синхронный — в поток, цикл событий бота не ждёт
+        await asyncio.to_thread(trader.start_trading)
         await context.bot.send_message(
             chat_id=update.effective_chat.id,
             text="🚀 *ИИ-трейдер запущен!*",
@@ -1163,7 +1167,8 @@ async def trader_status_command(update: Update, context: ContextTypes.DEFAULT_TY
             )
             return
 
-    msg = trader.format_portfolio_message()
+    # Сводка может запросить свежие цены (синхронный сетевой путь) — в поток
+    msg = await asyncio.to_thread(trader.format_portfolio_message)
     await context.bot.send_message(
         chat_id=update.effective_chat.id,
         text=msg,
@@ -1242,8 +1247,8 @@ async def trader_analyze_command(update: Update, context: ContextTypes.DEFAULT_T
         chat_id=update.effective_chat.id,
         text="🤖 ИИ анализирует рынок..."
     )
-    trader.analyze_and_trade()
-    portfolio = trader.format_portfolio_message()
+    await trader.analyze_and_trade_async()
+    portfolio = await asyncio.to_thread(trader.format_portfolio_message)
     await msg.edit_text(f"✅ *Анализ завершён*\n\n{portfolio}", parse_mode='Markdown')
 
 def clean_old_pulse_sentiment(self, days: int = 30):
@@ -7,19 +7,21 @@ matplotlib.use('Agg')  # Должен быть перед любым други
 import matplotlib.pyplot as plt
 import mplfinance as mpf
 from typing import List, Dict, Optional
-import tempfile
-import os
+import io
 import logging
+import threading
 
 logger = logging.getLogger(__name__)
 
+_PLOT_LOCK = threading.Lock()
+
 def plot_candlestick(
     history: List[Dict],
     ticker: str,
     ma_periods: List[int] = [5, 20],
     show_rsi: bool = False,
     show_macd: bool = False
-) -> Optional[str]:
+) -> Optional[io.BytesIO]:
     if not history:
         return None
 
@@ -99,23 +101,24 @@ def plot_candlestick(
     add_plots.append(mpf.make_addplot(df['Volume'], type='bar', panel=current_panel, color='gray', alpha=0.5, ylabel='Volume'))
     panel_ratios.append(1.5)
 
-    try:
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp:
-            fig, axes = mpf.plot(
-                df,
-                type='candle',
-                style=style,
-                title=f'{ticker} – свечной график',
-                ylabel='Цена (₽)',
-                volume=False,
-                addplot=add_plots,
-                panel_ratios=panel_ratios,
-                returnfig=True,
-                savefig=tmp.name
-            )
+    # pyplot хранит глобальное состояние фигур, а графики строятся из рабочих потоков бота
+    with _PLOT_LOCK:
+        fig, axes = mpf.plot(
+            df,
+            type='candle',
+            style=style,
+            title=f'{ticker} – свечной график',
+            ylabel='Цена (₽)',
+            volume=False,
+            addplot=add_plots,
+            panel_ratios=panel_ratios,
+            returnfig=True
+        )
+        # PNG рендерится прямо в память: send_photo принимает BytesIO, временный файл не нужен
+        buf = io.BytesIO()
+        try:
+            fig.savefig(buf, format='png')
+        finally:
             plt.close(fig)
-            return tmp.name
-    except Exception as e:
-        if 'tmp' in locals() and os.path.exists(tmp.name):
-            os.unlink(tmp.name)
-        raise e
\ No newline at end of file
+    buf.seek(0)
+    return buf
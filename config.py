@@ -27,6 +27,10 @@ def get_tinkoff_token() -> str:
 TELEGRAM_BOT_TOKEN = get_bot_token()
 TINKOFF_TOKEN = get_tinkoff_token()
 OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://localhost:11434")
+# Квантованная Q4_K_M-версия: на CPU инференс упирается в память, int4-веса в разы быстрее fp16.
+# Число потоков Ollama (num_thread) лучше выставить равным числу физических ядер.
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "gemma3:12b-it-q4_K_M")
+OLLAMA_NUM_THREAD = int(os.getenv("OLLAMA_NUM_THREAD", 0))  # 0 — оставить выбор Ollama
 
 TG_API_ID = int(os.getenv("TG_API_ID", 0))
 TG_API_HASH = os.getenv("TG_API_HASH", "")
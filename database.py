@@ -185,6 +185,14 @@ class NewsDatabase:
             df = pd.read_sql_query('SELECT * FROM moex_signals WHERE outcome IS NOT NULL', conn)
         return df
 
+    @staticmethod
+    def _trade_timestamp(trade_dict) -> str:
+        """ISO-время сделки: трейдер передаёт unix time в 'ts', старые записи — datetime/строку в 'timestamp'"""
+        if 'ts' in trade_dict:
+            return datetime.fromtimestamp(trade_dict['ts']).isoformat()
+        ts = trade_dict['timestamp']
+        return ts.isoformat() if isinstance(ts, datetime) else ts
+
     def save_trade(self, trade_dict):
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
@@ -193,7 +201,7 @@ class NewsDatabase:
                 (timestamp, ticker, action, shares, price, cost, fee, profit, balance_after, reason)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
             ''', (
-                trade_dict['timestamp'].isoformat() if isinstance(trade_dict['timestamp'], datetime) else trade_dict['timestamp'],
+                self._trade_timestamp(trade_dict),
                 trade_dict['ticker'],
                 trade_dict['action'],
                 trade_dict['shares'],
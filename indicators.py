@@ -0,0 +1,119 @@
+"""
+Общие технические индикаторы на массивах NumPy (MA, RSI, пересечения MA).
+С numba работают однопроходные ядра (компилируются один раз и кешируются на диск),
+без неё — векторные варианты на NumPy/pandas: интерпретируемый цикл был бы медленнее.
+"""
+import numpy as np
+import pandas as pd
+
+from jit_utils import njit, NUMBA_AVAILABLE
+
+
+@njit(cache=True)
+def _sma_kernel(values, window):
+    """Простая скользящая средняя; первые window-1 значений — NaN, как у pandas rolling().mean()"""
+    n = values.shape[0]
+    out = np.full(n, np.nan)
+    total = 0.0
+    missing = 0  # NaN в текущем окне: такое окно, как и в pandas, даёт NaN, но дальше ряд не портит
+    for i in range(n):
+        if np.isnan(values[i]):
+            missing += 1
+        else:
+            total += values[i]
+        if i >= window:
+            if np.isnan(values[i - window]):
+                missing -= 1
+            else:
+                total -= values[i - window]
+        if i >= window - 1 and missing == 0:
+            out[i] = total / window
+    return out
+
+
+@njit(cache=True)
+def _wilder_smooth_kernel(gain, loss, avg_gain, avg_loss, period):
+    """
+    Сглаживание Уайлдера (EMA с alpha = 1/period): avg[t] = avg[t-1] + (x[t] - avg[t-1]) / period.
+    avg_gain/avg_loss — значения на предыдущем баре, так что расчёт можно продолжать с середины истории.
+    """
+    n = gain.shape[0]
+    out_gain = np.empty(n)
+    out_loss = np.empty(n)
+    for i in range(n):
+        avg_gain += (gain[i] - avg_gain) / period
+        avg_loss += (loss[i] - avg_loss) / period
+        out_gain[i] = avg_gain
+        out_loss[i] = avg_loss
+    return out_gain, out_loss
+
+
+@njit(cache=True)
+def _crossover_kernel(ma_short, ma_long):
+    """
+    Сигналы пересечения MA: 1 — короткая пересекла длинную снизу вверх, -1 — сверху вниз, иначе 0.
+    Сравнения с NaN ложны, поэтому пока окна не набраны, сигналов нет.
+    """
+    n = ma_short.shape[0]
+    signals = np.zeros(n, dtype=np.int8)
+    for i in range(1, n):
+        if ma_short[i] > ma_long[i] and ma_short[i - 1] <= ma_long[i - 1]:
+            signals[i] = 1
+        elif ma_short[i] < ma_long[i] and ma_short[i - 1] >= ma_long[i - 1]:
+            signals[i] = -1
+    return signals
+
+
+def _sma_vectorized(values: np.ndarray, window: int) -> np.ndarray:
+    """То же, что _sma_kernel, через кумулятивные суммы значений и счётчика NaN."""
+    n = values.shape[0]
+    out = np.full(n, np.nan)
+    if n >= window:
+        finite = ~np.isnan(values)
+        total = np.concatenate(([0.0], np.cumsum(np.where(finite, values, 0.0))))
+        missing = np.concatenate(([0], np.cumsum(~finite)))
+        sums = total[window:] - total[:-window]
+        out[window - 1:] = np.where(missing[window:] - missing[:-window] > 0, np.nan, sums / window)
+    return out
+
+
+def _wilder_smooth_vectorized(gain: np.ndarray, loss: np.ndarray, avg_gain: float, avg_loss: float, period: float):
+    """То же, что _wilder_smooth_kernel: EMA pandas (adjust=False) с начальным значением в нулевой строке."""
+    def smooth(values, seed):
+        series = pd.Series(np.concatenate(([seed], values)))
+        return series.ewm(alpha=1.0 / period, adjust=False).mean().to_numpy()[1:]
+    return smooth(gain, avg_gain), smooth(loss, avg_loss)
+
+
+def _crossover_vectorized(ma_short: np.ndarray, ma_long: np.ndarray) -> np.ndarray:
+    """То же, что _crossover_kernel, на масках NumPy."""
+    signals = np.zeros(ma_short.shape[0], dtype=np.int8)
+    cross_up = (ma_short[1:] > ma_long[1:]) & (ma_short[:-1] <= ma_long[:-1])
+    cross_down = (ma_short[1:] < ma_long[1:]) & (ma_short[:-1] >= ma_long[:-1])
+    signals[1:] = np.where(cross_up, 1, np.where(cross_down, -1, 0))
+    return signals
+
+
+if NUMBA_AVAILABLE:
+    sma, wilder_smooth, crossover_signals = _sma_kernel, _wilder_smooth_kernel, _crossover_kernel
+else:
+    sma, wilder_smooth, crossover_signals = _sma_vectorized, _wilder_smooth_vectorized, _crossover_vectorized
+
+
+def rsi_from_changes(delta: np.ndarray, avg_gain: float = 0.0, avg_loss: float = 0.0, period: int = 14):
+    """
+    RSI по Уайлдеру для ряда изменений цены, продолжая сглаживание со средних avg_gain/avg_loss.
+    Возвращает (RSI, средний прирост, среднее падение) — средние нужны, чтобы досчитать ряд позже.
+    """
+    gains, losses = wilder_smooth(np.where(delta > 0, delta, 0.0), np.where(delta < 0, -delta, 0.0),
+                                  float(avg_gain), float(avg_loss), float(period))
+    rsi = 100 - 100 / (1 + gains / np.where(losses == 0, 1e-12, losses))
+    return rsi, gains, losses
+
+
+def rsi_wilder(values: np.ndarray, period: int = 14) -> np.ndarray:
+    """RSI по Уайлдеру с нуля (как в VirtualTrader); первые period значений — NaN."""
+    delta = np.diff(values, prepend=values[:1])  # у первого бара изменения нет
+    rsi, _, _ = rsi_from_changes(delta, period=period)
+    rsi[:period] = np.nan
+    return rsi
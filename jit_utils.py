@@ -0,0 +1,15 @@
+"""
+Необязательная поддержка numba: если она не установлена, @njit-функции выполняются как обычный Python
+"""
+
+try:
+    from numba import njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
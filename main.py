@@ -4,6 +4,7 @@
 import asyncio
 import logging
 import threading
+import httpx
 import services
 from telegram import Update
 from telegram.ext import Application, CommandHandler
@@ -65,6 +66,8 @@ async def run_bot():
         .connect_timeout(30)\
         .read_timeout(30)\
         .build()
+    # Общий асинхронный HTTP-клиент для обработчиков (запросы к Ollama)
+    app.bot_data['httpx'] = httpx.AsyncClient(timeout=30)
     
     # Регистрация обработчиков команд
     app.add_handler(CommandHandler("start", start))
@@ -157,6 +160,7 @@ async def run_bot():
         logger.info("🛑 Остановка бота...")
         if trader:
             trader.stop_trading()
+        await app.bot_data['httpx'].aclose()
         await app.stop()
         await app.shutdown()
 
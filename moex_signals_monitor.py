@@ -19,6 +19,7 @@ class MoexSignalsMonitor:
         self.feature_names = None
         self.confidence_threshold = 0.7
         self.check_interval = 30  # секунд между проверками RSS
+        self._portfolio_value = None  # стоимость портфеля трейдера в пределах одной проверки RSS
 
         # Попытаемся загрузить модель (если есть)
         from signal_model import load_model
@@ -44,6 +45,7 @@ class MoexSignalsMonitor:
             return
 
         db = services.db()
+        self._portfolio_value = None
         for sig in signals:
             # Используем id поста как уникальный идентификатор
             sig_id = sig.get('id')
@@ -93,13 +95,20 @@ class MoexSignalsMonitor:
             confidence = model_score
 
         if signal['type'] == 'bullish':
-            self.trader._buy(ticker, price, confidence, max_amount=None)
+            # Стоимость портфеля (с запросом цен) считаем один раз за проверку, а не в каждом _buy
+            if self._portfolio_value is None:
+                self._portfolio_value = await asyncio.to_thread(self.trader.get_portfolio_value)
+            trade = self.trader._buy(ticker, price, confidence, max_amount=None,
+                                     portfolio_value=self._portfolio_value)
+            if trade:
+                self._portfolio_value -= trade['fee']
         else:
-            if ticker in self.trader.portfolio:
-                shares = self.trader.portfolio[ticker]['shares']
-                sell_shares = int(shares * 0.5)
+            position = self.trader.get_position(ticker)
+            if position:
+                sell_shares = int(position.shares * 0.5)
                 if sell_shares > 0:
                     self.trader._sell(ticker, price, confidence, reason='moex_signal', shares=sell_shares)
+                    self._portfolio_value = None  # продажа по цене сигнала: пересчитаем при следующей покупке
 
     async def _send_notification(self, signal, model_score=None):
         emoji = "🟢" if signal['type'] == 'bullish' else "🔴"
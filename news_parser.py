@@ -7,6 +7,7 @@ from datetime import datetime, timedelta, timezone
 from typing import List, Dict, Optional, Any
 import logging
 from dataclasses import dataclass, field
+from functools import cached_property
 import requests
 import hashlib
 import re
@@ -33,6 +34,22 @@ class NewsItem:
     language: str = 'ru'
     category: str = 'unknown'  # finance, economy, politics, other
     image_path: Optional[str] = None
+    # Обрезанные заголовки для промптов и сообщений, считаются один раз при создании
+    title_100: str = field(init=False, repr=False, compare=False)
+    title_60: str = field(init=False, repr=False, compare=False)
+
+    def __post_init__(self) -> None:
+        self.title_100 = self.title[:100]
+        self.title_60 = self.title[:60]
+
+    @cached_property
+    def title_lower(self) -> str:
+        return self.title.lower()
+
+    @cached_property
+    def text_lower(self) -> str:
+        """Заголовок и описание в нижнем регистре — для поиска ключевых слов"""
+        return self.title_lower + " " + self.summary.lower()
     
     def to_dict(self) -> Dict[str, Any]:
         return {
@@ -0,0 +1,21 @@
+"""
+Словарная тональность постов (Smart-Lab, Tinkoff Пульс): общий список слов и regex для обоих парсеров.
+"""
+import re
+
+# Встречаемость ищется одним проходом regex на полярность (lookahead находит и вложенные слова,
+# например «растет» внутри «вырастет»), считаются различные найденные слова, как при проверке `w in text`
+POSITIVE_WORDS = ('растет', 'вырастет', 'прибыль', 'дивиденды', 'успех', 'дорожает', 'buy', 'long')
+NEGATIVE_WORDS = ('падает', 'упадет', 'убыток', 'проблемы', 'кризис', 'дешевеет', 'sell', 'short')
+_POSITIVE_RE = re.compile('(?=(' + '|'.join(map(re.escape, POSITIVE_WORDS)) + '))')
+_NEGATIVE_RE = re.compile('(?=(' + '|'.join(map(re.escape, NEGATIVE_WORDS)) + '))')
+
+
+def word_sentiment(text: str) -> float:
+    """Тональность от -1 до 1 по различным найденным словам; 0.0, если слов нет"""
+    text_lower = text.lower()
+    pos_count = len(set(_POSITIVE_RE.findall(text_lower)))
+    neg_count = len(set(_NEGATIVE_RE.findall(text_lower)))
+    if pos_count + neg_count == 0:
+        return 0.0
+    return (pos_count - neg_count) / (pos_count + neg_count)
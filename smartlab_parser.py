@@ -12,6 +12,7 @@ import os
 import uuid
 from urllib.parse import urljoin
 from bs4 import BeautifulSoup
+from sentiment import word_sentiment
 
 logger = logging.getLogger(__name__)
 
@@ -280,14 +281,7 @@ class SmartLabParser:
 
     def _simple_sentiment(self, text: str) -> float:
         """Простой анализ сентимента."""
-        text_lower = text.lower()
-        positive = ['растет', 'вырастет', 'прибыль', 'дивиденды', 'успех', 'дорожает', 'buy', 'long']
-        negative = ['падает', 'упадет', 'убыток', 'проблемы', 'кризис', 'дешевеет', 'sell', 'short']
-        pos_count = sum(1 for w in positive if w in text_lower)
-        neg_count = sum(1 for w in negative if w in text_lower)
-        if pos_count + neg_count == 0:
-            return 0
-        return (pos_count - neg_count) / (pos_count + neg_count)
+        return word_sentiment(text)
 
     def _parse_date(self, date_str: str) -> datetime:
         """Парсит дату из RSS."""
@@ -0,0 +1,72 @@
+"""Проверка Backtester: run_batch совпадает с отдельными прогонами run, с numba-путём и без него."""
+import numpy as np
+import pytest
+
+import backtester
+from backtester import Backtester
+from indicators import sma, crossover_signals
+
+
+def _bars(n: int, seed: int = 0) -> list:
+    rng = np.random.default_rng(seed)
+    closes = 100 + rng.normal(0, 1, n).cumsum()
+    return [{'time': i, 'close': float(c)} for i, c in enumerate(closes)]
+
+
+def _signals(bars: list, short: int, long: int) -> np.ndarray:
+    closes = np.array([b['close'] for b in bars])
+    return crossover_signals(sma(closes, short), sma(closes, long))
+
+
+@pytest.fixture(params=[True, False], ids=['numba-path', 'fallback'])
+def numba_available(request, monkeypatch):
+    """Прогоняет тест по обеим веткам run: массивы NumPy (numba) и списки (без numba)"""
+    monkeypatch.setattr(backtester, 'NUMBA_AVAILABLE', request.param)
+    return request.param
+
+
+def test_run_batch_matches_run(numba_available):
+    bars = _bars(250)
+    windows = [(3, 10), (5, 20), (10, 30), (20, 50)]
+    matrix = np.column_stack([_signals(bars, s, l) for s, l in windows])
+    bt = Backtester(initial_capital=100000, commission=0.003)
+
+    batch = bt.run_batch('SBER', bars, matrix)
+
+    assert sorted(batch) == list(range(len(windows)))
+    for k in range(len(windows)):
+        single = bt.run('SBER', bars, matrix[:, k].tolist())
+        summary = batch[k]
+        assert summary['final_equity'] == pytest.approx(single['final_equity'])
+        assert summary['total_return'] == pytest.approx(single['total_return'])
+        assert summary['max_drawdown'] == pytest.approx(single['max_drawdown'])
+        assert summary['sharpe_ratio'] == pytest.approx(single['sharpe_ratio'], nan_ok=True)
+        assert summary['trades_count'] == len(single['trades'])
+
+
+def test_run_paths_agree():
+    """Ветка с массивами и ветка со списками дают один и тот же прогон"""
+    bars = _bars(200, seed=1)
+    signals = _signals(bars, 5, 20).tolist()
+    bt = Backtester()
+    results = []
+    for available in (True, False):
+        with pytest.MonkeyPatch.context() as mp:
+            mp.setattr(backtester, 'NUMBA_AVAILABLE', available)
+            results.append(bt.run('GAZP', bars, signals))
+    with_arrays, with_lists = results
+    assert with_arrays['trades'] == with_lists['trades']
+    assert with_arrays['final_equity'] == pytest.approx(with_lists['final_equity'])
+    assert [p['equity'] for p in with_arrays['equity_curve']] == \
+        pytest.approx([p['equity'] for p in with_lists['equity_curve']])
+
+
+def test_run_closes_open_position(numba_available):
+    bars = _bars(30, seed=2)
+    signals = [0] * 30
+    signals[5] = 1
+    result = Backtester().run('LKOH', bars, signals)
+    actions = [t['action'] for t in result['trades']]
+    assert actions == ['BUY', 'SELL (close)']
+    assert result['trades'][0]['date'] == 5
+    assert len(result['equity_curve']) == 30
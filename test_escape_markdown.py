@@ -0,0 +1,17 @@
+"""Проверка экранирования Markdown в сообщениях бота."""
+import pytest
+
+bot = pytest.importorskip("bot")  # без telegram/httpx/dotenv модуль не импортируется
+
+
+def test_escape_markdown_special_chars():
+    assert bot.escape_markdown("SBER +5.2% (дивиденды)!") == "SBER \\+5\\.2% \\(дивиденды\\)\\!"
+
+
+def test_escape_markdown_plain_text_unchanged():
+    assert bot.escape_markdown("Сбербанк отчитался") == "Сбербанк отчитался"
+
+
+def test_escape_markdown_all_markdown_chars():
+    chars = '_*[]()~`>#+-=|{}.!'
+    assert bot.escape_markdown(chars) == ''.join('\\' + c for c in chars)
@@ -0,0 +1,101 @@
+"""Проверка ядер indicators.py (цикл для numba и векторный вариант без неё) по эталону pandas."""
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import indicators
+import jit_utils
+
+SMA_IMPLS = [indicators._sma_kernel, indicators._sma_vectorized]
+WILDER_IMPLS = [indicators._wilder_smooth_kernel, indicators._wilder_smooth_vectorized]
+CROSSOVER_IMPLS = [indicators._crossover_kernel, indicators._crossover_vectorized]
+
+
+def _random_walk(n: int, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    return 100 + rng.normal(0, 1, n).cumsum()
+
+
+def _pandas_rsi(closes: np.ndarray, period: int = 14) -> np.ndarray:
+    """RSI по Уайлдеру средствами pandas: EMA с alpha = 1/period, adjust=False"""
+    delta = pd.Series(closes).diff().fillna(0.0)
+    gain = delta.clip(lower=0).ewm(alpha=1 / period, adjust=False).mean()
+    loss = (-delta).clip(lower=0).ewm(alpha=1 / period, adjust=False).mean()
+    rsi = (100 - 100 / (1 + gain / loss)).to_numpy(copy=True)
+    rsi[:period] = np.nan
+    return rsi
+
+
+@pytest.fixture
+def without_numba(monkeypatch):
+    """indicators, импортированный так, будто numba не установлена"""
+    monkeypatch.setattr(jit_utils, 'NUMBA_AVAILABLE', False)
+    yield importlib.reload(indicators)
+    monkeypatch.undo()
+    importlib.reload(indicators)
+
+
+@pytest.mark.parametrize('impl', SMA_IMPLS)
+@pytest.mark.parametrize('window', [5, 20])
+def test_sma_matches_pandas_rolling(impl, window):
+    closes = _random_walk(200)
+    expected = pd.Series(closes).rolling(window).mean().to_numpy()
+    np.testing.assert_allclose(impl(closes, window), expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('impl', SMA_IMPLS)
+def test_sma_nan_spoils_only_its_windows(impl):
+    closes = _random_walk(60)
+    closes[[10, 30]] = np.nan
+    expected = pd.Series(closes).rolling(5).mean().to_numpy()
+    np.testing.assert_allclose(impl(closes, 5), expected, equal_nan=True)
+
+
+@pytest.mark.parametrize('impl', SMA_IMPLS)
+def test_sma_shorter_than_window(impl):
+    assert np.isnan(impl(_random_walk(3), 5)).all()
+
+
+@pytest.mark.parametrize('impl', WILDER_IMPLS)
+def test_rsi_wilder_matches_pandas_ewm(monkeypatch, impl):
+    monkeypatch.setattr(indicators, 'wilder_smooth', impl)
+    closes = _random_walk(120, seed=1)
+    np.testing.assert_allclose(indicators.rsi_wilder(closes, 14), _pandas_rsi(closes, 14), equal_nan=True)
+
+
+@pytest.mark.parametrize('impl', WILDER_IMPLS)
+def test_rsi_from_changes_continues_from_seed(monkeypatch, impl):
+    """Досчёт хвоста со средних предыдущего бара совпадает с расчётом с нуля"""
+    monkeypatch.setattr(indicators, 'wilder_smooth', impl)
+    closes = _random_walk(80, seed=2)
+    delta = np.diff(closes, prepend=closes[:1])
+    full, gains, losses = indicators.rsi_from_changes(delta)
+    tail, _, _ = indicators.rsi_from_changes(delta[50:], gains[49], losses[49])
+    np.testing.assert_allclose(tail, full[50:])
+
+
+@pytest.mark.parametrize('impl', CROSSOVER_IMPLS)
+def test_crossover_signals_match_pandas_masks(impl):
+    closes = pd.Series(_random_walk(300, seed=3))
+    ma_short = closes.rolling(5).mean()
+    ma_long = closes.rolling(20).mean()
+    prev_short, prev_long = ma_short.shift(1), ma_long.shift(1)
+    cross_up = (ma_short > ma_long) & (prev_short <= prev_long)
+    cross_down = (ma_short < ma_long) & (prev_short >= prev_long)
+    expected = np.where(cross_up, 1, np.where(cross_down, -1, 0))
+    signals = impl(ma_short.to_numpy(), ma_long.to_numpy())
+    assert signals.dtype == np.int8
+    np.testing.assert_array_equal(signals, expected)
+    assert (signals != 0).any()
+
+
+def test_fallback_selected_without_numba(without_numba):
+    assert without_numba.sma is without_numba._sma_vectorized
+    assert without_numba.wilder_smooth is without_numba._wilder_smooth_vectorized
+    assert without_numba.crossover_signals is without_numba._crossover_vectorized
+
+    closes = _random_walk(100, seed=4)
+    np.testing.assert_allclose(without_numba.sma(closes, 20), pd.Series(closes).rolling(20).mean(), equal_nan=True)
+    np.testing.assert_allclose(without_numba.rsi_wilder(closes), _pandas_rsi(closes), equal_nan=True)
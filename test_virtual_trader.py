@@ -0,0 +1,112 @@
+"""Проверка учёта портфеля VirtualTrader: параллельные массивы позиций и их сохранение в SQLite."""
+import os
+
+import pytest
+
+# config требует токены при импорте; сетевые сервисы в тестах подменяются
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', 'test')
+os.environ.setdefault('TINKOFF_TOKEN', 'test')
+
+import services  # noqa: E402
+from ai_trader import VirtualTrader, Position  # noqa: E402
+
+PORTFOLIO_VALUE = 1_000_000
+
+
+@pytest.fixture
+def make_trader(tmp_path, monkeypatch):
+    """Создаёт трейдеров над одной и той же временной папкой состояния"""
+    monkeypatch.chdir(tmp_path)  # снимок пишется в относительную папку data/
+    monkeypatch.setattr(VirtualTrader, 'STATE_DB_PATH', str(tmp_path / 'data' / 'trader.db'))
+    monkeypatch.setattr(VirtualTrader, 'SNAPSHOT_PATH', str(tmp_path / 'data' / 'trader_snapshot.json'))
+    monkeypatch.setattr(VirtualTrader, 'TRADES_LOG_PATH', str(tmp_path / 'data' / 'trades.ndjson'))
+    monkeypatch.setattr(VirtualTrader, 'LEGACY_STATE_PATH', str(tmp_path / 'data' / 'trader_state.json'))
+    for name in ('ai_advisor', 'stock_provider', 'db'):
+        monkeypatch.setitem(services._services, name, None)
+
+    traders = []
+
+    def make():
+        trader = VirtualTrader(initial_balance=PORTFOLIO_VALUE)
+        traders.append(trader)
+        return trader
+
+    yield make
+    for trader in traders:
+        trader._state_db.close()
+
+
+def _buy(trader: VirtualTrader, ticker: str, price: float, amount: float = 100_000):
+    return trader._buy(ticker, price, 0.8, max_amount=amount, portfolio_value=PORTFOLIO_VALUE)
+
+
+def _assert_consistent(trader: VirtualTrader):
+    """Индекс тикеров указывает на свои строки массивов, длины массивов совпадают"""
+    assert len(trader._tickers) == len(trader._shares) == len(trader._avg_price)
+    assert trader._ticker_idx == {ticker: i for i, ticker in enumerate(trader._tickers)}
+
+
+def test_buy_opens_and_averages_positions(make_trader):
+    trader = make_trader()
+    first = _buy(trader, 'SBER', 250.0)
+    _buy(trader, 'GAZP', 160.0)
+    second = _buy(trader, 'SBER', 300.0)
+
+    assert trader._tickers == ['SBER', 'GAZP']
+    _assert_consistent(trader)
+    shares = first['shares'] + second['shares']
+    assert trader.get_position('SBER') == Position(
+        shares, pytest.approx((first['cost'] + second['cost']) / shares))
+    assert trader.get_position('GAZP').avg_price == 160.0
+
+    spent = sum(t['cost'] + t['fee'] for t in trader.trades)
+    assert trader.balance == pytest.approx(PORTFOLIO_VALUE - spent)
+
+
+def test_partial_sell_keeps_index_and_average(make_trader):
+    trader = make_trader()
+    _buy(trader, 'SBER', 250.0)
+    _buy(trader, 'GAZP', 160.0)
+    before = trader.get_position('GAZP')
+
+    trader._sell('GAZP', 170.0, 0.7, shares=100)
+
+    assert trader.get_position('GAZP') == Position(before.shares - 100, before.avg_price)
+    assert trader._tickers == ['SBER', 'GAZP']
+    _assert_consistent(trader)
+    assert trader.trades[-1]['profit'] == pytest.approx((170.0 - 160.0) * 100)
+
+
+def test_full_close_of_middle_position_reindexes(make_trader):
+    trader = make_trader()
+    for ticker, price in (('SBER', 250.0), ('GAZP', 160.0), ('LKOH', 7000.0)):
+        _buy(trader, ticker, price)
+    lkoh = trader.get_position('LKOH')
+    trader.highest_price['GAZP'] = 165.0
+
+    trader._sell('GAZP', 150.0, 1.0, sell_all=True)
+
+    assert trader._tickers == ['SBER', 'LKOH']
+    assert trader._ticker_idx == {'SBER': 0, 'LKOH': 1}
+    _assert_consistent(trader)
+    assert trader.get_position('GAZP') is None
+    assert trader.get_position('LKOH') == lkoh
+    assert 'GAZP' not in trader.highest_price
+    assert list(trader.portfolio) == ['SBER', 'LKOH']
+
+
+def test_state_round_trip_through_sqlite(make_trader):
+    trader = make_trader()
+    for ticker, price in (('SBER', 250.0), ('GAZP', 160.0), ('LKOH', 7000.0)):
+        _buy(trader, ticker, price)
+    trader._sell('SBER', 260.0, 0.7, shares=50)
+    trader._sell('GAZP', 150.0, 1.0, sell_all=True)
+    trader._save_state()
+
+    reloaded = make_trader()
+
+    assert reloaded.balance == pytest.approx(trader.balance)
+    assert reloaded.portfolio == trader.portfolio
+    _assert_consistent(reloaded)
+    assert [(t['ticker'], t['action'], t['shares']) for t in reloaded.trades] == \
+        [(t['ticker'], t['action'], t['shares']) for t in trader.trades]
@@ -7,6 +7,7 @@ import time
 from datetime import datetime
 from typing import List, Dict, Optional, Any
 from dataclasses import dataclass, field
+from sentiment import word_sentiment
 
 logger = logging.getLogger(__name__)
 
@@ -143,16 +144,7 @@ class TinkoffPulseParser:
 
     def _analyze_sentiment(self, text: str) -> tuple:
         """Анализирует тональность текста, возвращает (score, category)."""
-        text_lower = text.lower()
-        positive_words = ['растет', 'вырастет', 'прибыль', 'дивиденды', 'успех', 'дорожает', 'buy', 'long']
-        negative_words = ['падает', 'упадет', 'убыток', 'проблемы', 'кризис', 'дешевеет', 'sell', 'short']
-        pos_count = sum(1 for w in positive_words if w in text_lower)
-        neg_count = sum(1 for w in negative_words if w in text_lower)
-
-        if pos_count + neg_count > 0:
-            score = (pos_count - neg_count) / (pos_count + neg_count)
-        else:
-            score = 0.0
+        score = word_sentiment(text)
 
         if score > 0.2:
             category = 'positive'
@@ -3,9 +3,13 @@
 Исправленная версия с приоритетом правильных FIGI и методом get_history
 """
 
+import asyncio
 import requests
+import httpx
 from datetime import datetime, timedelta
 import logging
+import threading
+from collections import OrderedDict
 from typing import List, Dict, Optional, Any
 from figi_manager import FigiManager
 from requests.adapters import HTTPAdapter
@@ -16,6 +20,9 @@ logger = logging.getLogger(__name__)
 class TinkoffStockProvider:
     """Провайдер для получения цен через Tinkoff API с авто-FIGI"""
 
+    HISTORY_TTL = timedelta(hours=1)  # дневные свечи; VirtualTrader держит свой кэш и этот обходит
+    MAX_HISTORY_CACHE = 512
+
     def __init__(self, token):
         self.token = token
         self.base_url = "https://invest-public-api.tinkoff.ru/rest"
@@ -58,6 +65,10 @@ class TinkoffStockProvider:
         self.price_cache = {}
         self.last_update = {}
 
+        # Кэш истории: (тикер, дней) -> (время запроса, свечи), LRU; get_history зовут из рабочих потоков бота
+        self.history_cache: "OrderedDict[tuple, tuple]" = OrderedDict()
+        self._history_lock = threading.Lock()
+
         # Названия компаний
         self.company_names = {
             'SBER': 'Сбербанк',
@@ -150,35 +161,25 @@ class TinkoffStockProvider:
             response = requests.post(url, headers=self.headers, json=payload, timeout=10)
 
             if response.status_code == 200:
-                data = response.json()
+                return self._parse_last_price(ticker, figi, response.json())
+            else:
+                logger.debug(f"⚠️ {ticker}: HTTP {response.status_code}")
 
-                if 'lastPrices' in data and len(data['lastPrices']) > 0:
-                    price_data = data['lastPrices'][0]
-
-                    if 'price' in price_data:
-                        price_info = price_data['price']
-                        units = price_info.get('units', 0)
-                        nano = price_info.get('nano', 0)
-                        # Приводим к int, если пришли строки
-                        try:
-                            units = int(units)
-                        except (ValueError, TypeError):
-                            units = 0
-                        try:
-                            nano = int(nano)
-                        except (ValueError, TypeError):
-                            nano = 0
-                        price = units + nano / 1_000_000_000
-
-                        self.price_cache[ticker] = price
-                        self.last_update[ticker] = datetime.now()
-
-                        logger.info(f"✅ {ticker}: {price:.2f} ₽ (FIGI: {figi})")
-                        return price
-                    else:
-                        logger.debug(f"⚠️ {ticker}: нет price в ответе")
-                else:
-                    logger.debug(f"⚠️ {ticker}: нет lastPrices в ответе")
+        except Exception as e:
+            logger.debug(f"⚠️ Ошибка для {ticker}: {e}")
+
+        return None
+
+    async def _get_price_by_figi_async(self, ticker: str, figi: str, client: httpx.AsyncClient) -> Optional[float]:
+        """Асинхронная версия _get_price_by_figi на общем httpx.AsyncClient"""
+        url = f"{self.base_url}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetLastPrices"
+        payload = {"figi": [figi]}
+
+        try:
+            response = await client.post(url, headers=self.headers, json=payload)
+
+            if response.status_code == 200:
+                return self._parse_last_price(ticker, figi, response.json())
             else:
                 logger.debug(f"⚠️ {ticker}: HTTP {response.status_code}")
 
@@ -187,6 +188,99 @@ class TinkoffStockProvider:
 
         return None
 
+    def _parse_last_price(self, ticker: str, figi: str, data: Dict[str, Any]) -> Optional[float]:
+        """Достаёт цену из ответа GetLastPrices и кладёт её в кэш"""
+        if 'lastPrices' in data and len(data['lastPrices']) > 0:
+            price_data = data['lastPrices'][0]
+
+            if 'price' in price_data:
+                price = self._quotation_to_float(price_data['price'])
+
+                self.price_cache[ticker] = price
+                self.last_update[ticker] = datetime.now()
+
+                logger.info(f"✅ {ticker}: {price:.2f} ₽ (FIGI: {figi})")
+                return price
+            else:
+                logger.debug(f"⚠️ {ticker}: нет price в ответе")
+        else:
+            logger.debug(f"⚠️ {ticker}: нет lastPrices в ответе")
+        return None
+
+    async def get_price_async(self, ticker: str, client: httpx.AsyncClient) -> Optional[Dict[str, float]]:
+        """Асинхронный аналог get_price: запросы идут через переданный пул соединений"""
+        ticker = ticker.upper()
+
+        if ticker in self.last_update:
+            if datetime.now() - self.last_update[ticker] < timedelta(minutes=5):
+                return {'last_price': self.price_cache[ticker]}
+
+        if ticker in self.priority_figi:
+            price = await self._get_price_by_figi_async(ticker, self.priority_figi[ticker], client)
+            if price:
+                return {'last_price': price}
+
+        # Поиск FIGI синхронный (requests + SQLite), уводим его в поток
+        figi_info = await asyncio.to_thread(self.figi_manager.find_figi, ticker)
+        if figi_info and figi_info.get('figi'):
+            figi = figi_info['figi']
+            price = await self._get_price_by_figi_async(ticker, figi, client)
+            if price:
+                self.priority_figi[ticker] = figi
+                return {'last_price': price}
+
+        logger.warning(f"⚠️ {ticker}: не удалось получить цену")
+        return None
+
+    def _split_for_batch(self, tickers) -> tuple[Dict[str, float], Dict[str, str]]:
+        """Делит тикеры на взятые из кэша цен и те, чей FIGI уже известен: {figi: тикер} для пакетного запроса"""
+        cached = {}
+        figi_tickers = {}
+        now = datetime.now()
+        for ticker in tickers:
+            key = ticker.upper()
+            if key in self.last_update and now - self.last_update[key] < timedelta(minutes=5):
+                cached[ticker] = self.price_cache[key]
+            elif key in self.priority_figi:
+                figi_tickers[self.priority_figi[key]] = ticker
+        return cached, figi_tickers
+
+    def _parse_last_prices(self, figi_tickers: Dict[str, str], data: Dict[str, Any]) -> Dict[str, float]:
+        """Разбирает пакетный ответ GetLastPrices в {тикер: цена} и кладёт цены в кэш"""
+        prices = {}
+        now = datetime.now()
+        for price_data in data.get('lastPrices', []):
+            ticker = figi_tickers.get(price_data.get('figi'))
+            if ticker is None or 'price' not in price_data:
+                continue
+            price = self._quotation_to_float(price_data['price'])
+            if price:
+                prices[ticker] = price
+                self.price_cache[ticker.upper()] = price
+                self.last_update[ticker.upper()] = now
+        logger.info(f"✅ Цены {len(prices)} из {len(figi_tickers)} тикеров одним запросом GetLastPrices")
+        return prices
+
+    async def get_prices_async(self, tickers, client: httpx.AsyncClient) -> Dict[str, float]:
+        """
+        Цены списка тикеров: свежие берутся из кэша, остальные с известным FIGI — одним запросом GetLastPrices.
+        Тикеры без цены в ответе не попадают в результат (их можно дозапросить через get_price_async).
+        """
+        prices, figi_tickers = self._split_for_batch(tickers)
+        if not figi_tickers:
+            return prices
+
+        url = f"{self.base_url}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetLastPrices"
+        try:
+            response = await client.post(url, headers=self.headers, json={"figi": list(figi_tickers)})
+            if response.status_code == 200:
+                prices.update(self._parse_last_prices(figi_tickers, response.json()))
+            else:
+                logger.debug(f"⚠️ GetLastPrices: HTTP {response.status_code}")
+        except Exception as e:
+            logger.debug(f"⚠️ Ошибка пакетного запроса цен: {e}")
+        return prices
+
     def _quotation_to_float(self, quotation: Dict[str, Any]) -> float:
         """Преобразует quotation из API в число с плавающей точкой.
         quotation должен содержать ключи 'units' и 'nano' (могут быть int или str).
@@ -203,10 +297,11 @@ class TinkoffStockProvider:
             nano = 0
         return units + nano / 1_000_000_000
 
-    def get_history(self, ticker: str, days: int = 30) -> List[Dict[str, Any]]:
+    def get_history(self, ticker: str, days: int = 30, use_cache: bool = True) -> List[Dict[str, Any]]:
         """
         Получает исторические цены (OHLCV) за последние N дней.
         Используем свечи с дневным интервалом.
+        use_cache=False — всегда свежий запрос (у VirtualTrader свой кэш истории, второй слой только добавил бы задержку).
         """
         ticker = ticker.upper()
         try:
@@ -214,6 +309,15 @@ class TinkoffStockProvider:
         except:
             days = 30
 
+        # Повторные запросы той же истории в течение HISTORY_TTL обслуживаются из памяти
+        key = (ticker, days)
+        if use_cache:
+            with self._history_lock:
+                cached = self.history_cache.get(key)
+                if cached and datetime.now() - cached[0] < self.HISTORY_TTL:
+                    self.history_cache.move_to_end(key)
+                    return list(cached[1])
+
         # Сначала пробуем взять FIGI из приоритетного списка
         figi = self.priority_figi.get(ticker)
         if not figi:
@@ -257,7 +361,13 @@ class TinkoffStockProvider:
                         'close': self._quotation_to_float(c['close']),
                         'volume': c['volume']
                     })
-                return history
+                if history:
+                    with self._history_lock:
+                        self.history_cache[key] = (datetime.now(), history)
+                        self.history_cache.move_to_end(key)
+                        while len(self.history_cache) > self.MAX_HISTORY_CACHE:
+                            self.history_cache.popitem(last=False)
+                return list(history)
             else:
                 logger.error(f"Ошибка HTTP {response.status_code} при получении истории {ticker}")
                 logger.debug(f"Ответ: {response.text[:200]}")
@@ -281,9 +391,23 @@ class TinkoffStockProvider:
         }
 
     def get_prices_batch(self, tickers):
-        """Получает цены для списка тикеров"""
-        results = {}
+        """Получает цены для списка тикеров: известные FIGI — одним запросом, остальные поштучно"""
+        results, figi_tickers = self._split_for_batch(tickers)
+
+        if figi_tickers:
+            url = f"{self.base_url}/tinkoff.public.invest.api.contract.v1.MarketDataService/GetLastPrices"
+            try:
+                response = requests.post(url, headers=self.headers, json={"figi": list(figi_tickers)}, timeout=10)
+                if response.status_code == 200:
+                    results.update(self._parse_last_prices(figi_tickers, response.json()))
+                else:
+                    logger.debug(f"⚠️ GetLastPrices: HTTP {response.status_code}")
+            except Exception as e:
+                logger.debug(f"⚠️ Ошибка пакетного запроса цен: {e}")
+
         for ticker in tickers:
+            if ticker in results:
+                continue
             price_info = self.get_price(ticker)
             if price_info:
                 results[ticker] = price_info['last_price']